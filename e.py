@@ -17,19 +17,40 @@ Day-iteration:
 5-d: Python Structure
 5-e: Better obstacle handling
 """
+import argparse
+import array
+import bisect
+import collections
+import functools
+import heapq
+import itertools
 import os
 import random
+import struct
+import sys
+import time
+import weakref
 
 import pygame
 
 
 BOARD_SIZE = BOARD_WIDTH, BOARD_HEIGHT = 480, 640
 FRAME_RATE = 30
+PACER_MODES = ('tick', 'busy', 'hybrid')
+PACER_SPIN = 0.002  # Seconds before a deadline that hybrid pacing spins
+PACER_WINDOW = FRAME_RATE * 2  # Presents judged before changing divisor
+PACER_LATE = 1.25  # Presents this much slower than planned are late
+PACER_MISSES = 0.2  # Share of late presents that makes drawing slower
+PACER_RECOVER = 0.7  # Share of a tick all drawn frames must fit in to
+# make drawing faster again
+PACER_DIVISOR_MAX = 4  # Most ticks between drawn frames
+PACER_BUCKETS = 100  # Histogram buckets, in ms; slower presents go last
 BOARD_COLOR = (255, 255, 255)
 PLAYER_SPEED = 5
 DOWNHILL_SPEED = 4
 OBSTACLES_MAX = 25
 OBSTACLE_CHOICES = ['tree'] * 20 + ['flag'] * 4 + ['ramp'] * 1
+OBSTACLE_KINDS = ('tree', 'flag', 'ramp')  # Codes used in files
 POINTS = 10
 IMAGE_FILES = (
     'kiiro',
@@ -37,39 +58,144 @@ IMAGE_FILES = (
     'kiiro-sw',
     'kiiro-shadow',
     'kiiro-stunned',
+    'kiiro-e',
+    'kiiro-w',
     'tree',
     'flag',
     'ramp',
     )
 IMAGE_PATH = 'images'
+IMAGE_KEY = (255, 0, 255)  # Colorkey for images without partly clear pixels
+IMAGE_CACHE = os.path.join('.cache', 'images')  # Converted images, or None
+IMAGE_CACHE_HEADER = struct.Struct('<HHB')  # width, height, path
+IMAGE_CACHE_PATHS = ('opaque', 'colorkey', 'alpha')
 SOUND_FILES = (
     'bonus',
     'crash',
     'gameover',
     'jump',
+    'pause',
     )
 SOUND_PATH = 'sounds'
 BG_MUSIC = 'music'
 CRASH_MAX = 3  # How many crashes are allowed before the game ends
 CRASH_TIME = FRAME_RATE * 2  # How many seconds each crash delays the game
 JUMP_TIME = FRAME_RATE * 2  # How many seconds to get to maximum height
+PAUSE_ATTRACT = 60  # Seconds paused before the attract screen is shown
+SAFE_TIME = FRAME_RATE * 1  # How long trees are harmless after a crash stun
+BLINK_TICKS = 3  # Frames between blinks while trees are harmless
+FADE_TIME = FRAME_RATE // 2  # How long picked up flags take to fade out
+EFFECT_LEVELS = 8  # Steps each effect is made in, from none to full
+TINT_COLOR = (255, 70, 70)  # Crash tint, as a color to multiply by
+ANIMATION_TICKS = 4  # Frames each animation image is shown for
+WOBBLE_ANGLES = (0, 6, 10, 6, 0, -6, -10, -6)  # Stunned wobble, in degrees
+TUCK_SCALES = (1.0, 0.94, 0.88, 0.82)  # Shrinking into a tuck in a jump
+SWEEP_STEP = 2  # Most pixels moved between mask tests along a sweep
+BENCHMARK_COUNTS = (25, 250, 2500)  # Obstacles on the board for --benchmark
+BENCHMARK_FRAMES = 100
 TEXT_SIZE = 40
 TEXT_COLOR = (204, 0, 255)
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_UP = 4
+INPUT_DOWN = 8
+INPUT_QUIT = 16
+INPUT_PAUSE = 32
+INPUT_RETRY = 64
+INPUT_SEEK_BACK = 128
+INPUT_SEEK_FORWARD = 256
+INPUT_SPEED_UP = 512
+INPUT_SPEED_DOWN = 1024
+INPUT_STEER = INPUT_LEFT | INPUT_RIGHT | INPUT_UP | INPUT_DOWN  # Recorded
+KEY_BINDINGS = {  # Keys held down, read once per frame
+    pygame.K_LEFT: INPUT_LEFT,
+    pygame.K_RIGHT: INPUT_RIGHT,
+    pygame.K_UP: INPUT_UP,
+    pygame.K_DOWN: INPUT_DOWN,
+    }
+KEY_PRESSES = {  # Keys that only count when they go down
+    pygame.K_ESCAPE: INPUT_QUIT,
+    pygame.K_p: INPUT_PAUSE,
+    pygame.K_r: INPUT_RETRY,
+    # The arrow keys also steer while held; only replays read these bits
+    pygame.K_LEFT: INPUT_SEEK_BACK,
+    pygame.K_RIGHT: INPUT_SEEK_FORWARD,
+    pygame.K_UP: INPUT_SPEED_UP,
+    pygame.K_DOWN: INPUT_SPEED_DOWN,
+    }
+ALLOWED_EVENTS = (pygame.QUIT, pygame.KEYDOWN)
+BACKGROUND_TILE = 256  # Height of the pre-rendered snow texture
+SNOW_SPECKS = 900  # Noise dots in each snow texture tile
+SNOW_COLORS = ((236, 240, 248), (244, 246, 252), (226, 232, 244))
+TRACK_COLOR = (214, 222, 238)
+TRACK_GAP = 6  # Pixels between the two skis
+TRAIL_KEY = (255, 0, 255)  # Colorkey for the empty parts of the trail layer
+CHUNK_HEIGHT = BOARD_HEIGHT // 2  # Course slice drawn into one chunk image
+PARTICLES_MAX = 1024  # Hard cap on particles alive at once
+PARTICLE_GRAVITY = 0.3  # Added to each particle's down speed every frame
+SPRAY = (12, 3.0, 12, (190, 205, 230))  # count, speed, life, color
+DEBRIS = (40, 5.0, 24, (40, 140, 40))
+DUST = (24, 2.0, 16, (215, 222, 240))
+SNAPSHOT_MAGIC = b'SKIS'
+SNAPSHOT_VERSION = 3
+SNAPSHOT_HEADER = struct.Struct('<4sHIIiiiIII')
+# magic, version, tick, seed, camera y, camera speed, course spawned,
+# next obstacle order, active obstacles, dormant obstacles
+SNAPSHOT_PLAYER = struct.Struct('<10i?BI')
+# x, y, x_inc, y_inc, speed, score, crashes, crash_time, jump_time,
+# safe_time, jumping, animation, animation ticks
+SNAPSHOT_OBSTACLE = struct.Struct('<BiihhI')  # kind, x, y, x_inc, y_inc, order
+SNAPSHOT_RANDOM = struct.Struct('<625I?d')  # Random state, gauss_next
+COURSE_MAGIC = b'SKIC'
+COURSE_VERSION = 1
+COURSE_SEGMENT = BOARD_HEIGHT  # World pixels covered by one course segment
+COURSE_CACHE = 4  # How many decoded segments to keep in memory
+COURSE_HEADER = struct.Struct('<4sHHI')  # magic, version, segment, count
+COURSE_INDEX = struct.Struct('<III')  # start distance, offset, records
+COURSE_RECORD = struct.Struct('<BHI')  # kind, x, y
+LEADERBOARD_FILE = 'scores.db'
+LEADERBOARD_SIZE = 10  # Entries shown at the end of a game
+LEADERBOARD_BATCH = 64  # Most scores written in one transaction
+LEADERBOARD_TEXT = 24  # Text size of the leaderboard
+TELEMETRY_SIZE = 4096  # Records the ring buffer holds before dropping
+TELEMETRY_INTERVAL = 0.5  # Seconds between drains of the ring buffer
+TELEMETRY_ROTATE = 1 << 20  # Uncompressed bytes in one log file
+TELEMETRY_KEEP = 20  # Log files kept; older ones are deleted
+METRICS_HOST = '127.0.0.1'  # Only scrapers on this machine can connect
+METRICS_WINDOW = 256  # Recent frames that frame time percentiles cover
+METRICS_QUANTILES = (0.5, 0.9, 0.99)
+METRICS_FPS_FRAMES = 10  # Presented frames the fps gauge averages over
+REPLAY_MAGIC = b'SKIR'
+REPLAY_VERSION = 5
+REPLAY_KEYFRAME = FRAME_RATE * 5  # Ticks between snapshots in a replay
+REPLAY_HEADER = struct.Struct('<4sHIIIIii')
+# magic, version, seed, first tick, keyframes, input runs, claimed score,
+# claimed crashes
+REPLAY_INDEX = struct.Struct('<III')  # tick, offset, size of a keyframe
+REPLAY_RUN = struct.Struct('<BH')  # input bits, ticks they were held for
+REPLAY_SPEEDS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)  # Playback speeds
+REPLAY_SEEK = FRAME_RATE * 5  # Ticks skipped by the left and right keys
 
 
 class ImageStore:
     """Storage for images.
     """
-    def __init__(self, path='', ext='png'):
+    def __init__(self, path='', ext='png', cache=None):
         """Initialize the image store with location and type of images.
 
         Args:
             path: Path to images folder
             ext: Extension for imagesfiles, with no dot.
+            cache: Folder for converted images, or None for no cache.
         """
         self.store = {}
+        self.masks = {}
+        self.paths = {}  # How each image was converted, for report()
         self.path = path
         self.ext = ext.strip('.')
+        self.cache = cache
+        self.cache_files = {}
+        self.cache_format = None
 
     def get(self, name):
         """Get an image in the image store.
@@ -84,15 +210,201 @@ class ImageStore:
         """
         if name not in self.store:
             image_file = os.path.join(self.path, f'{name}.{self.ext}')
-            try:
-                image = pygame.image.load(image_file).convert_alpha()
-            except:
-                image = text2image(name, 20, (255, 0, 0))
+            image = self.load_cached(name, image_file)
+            if image is None:
+                try:
+                    image = pygame.image.load(image_file)
+                except:
+                    image = text2image(name, 20, (255, 0, 0))
+                    self.paths[name] = 'text'
+                self.masks[name] = pygame.mask.from_surface(image)
+                if name not in self.paths:
+                    image = self.convert(name, image)
+                    self.save_cached(name, image_file, image)
             self.store[name] = image
         else:
             image = self.store[name]
         return image
 
+    def convert(self, name, image):
+        """Convert a loaded image to the fastest format that draws it right.
+
+        Images with no see-through pixels are plain convert()ed. Images
+        whose pixels are all either fully clear or fully solid are drawn
+        with a colorkey and RLEACCEL, which skips the clear runs instead of
+        blending them. Only images with partly clear pixels keep per-pixel
+        alpha.
+
+        Args:
+            name: Name of image.
+            image: Surface object, as loaded.
+
+        Returns:
+            The converted surface.
+        """
+        width, height = image.get_size()
+        solid = pygame.mask.from_surface(image, 254).count()
+        if solid == width * height:
+            self.paths[name] = 'opaque'
+            image = image.convert()
+            image.set_colorkey(None)
+            return image
+        if solid == self.masks[name].count():
+            keyed = pygame.Surface((width, height)).convert()
+            keyed.fill(IMAGE_KEY)
+            keyed.blit(image, (0, 0))
+            clear = pygame.mask.from_threshold(keyed, IMAGE_KEY,
+                                               (1, 1, 1, 255)).count()
+            if clear == width * height - solid:
+                keyed.set_colorkey(IMAGE_KEY, pygame.RLEACCEL)
+                self.paths[name] = 'colorkey'
+                return keyed
+        self.paths[name] = 'alpha'
+        return image.convert_alpha()
+
+    def cache_file(self, name, image_file):
+        """Find where the converted image for an image file is cached.
+
+        The cache file name has a hash of the image file and of the
+        display's pixel format, so a changed image or a different display
+        never picks up an old cache file.
+
+        Args:
+            name: Name of image.
+            image_file: Path to the image file.
+
+        Returns:
+            Path to the cache file, or None if there is no cache for it.
+        """
+        if name in self.cache_files:
+            return self.cache_files[name]
+        cache_file = None
+        if self.cache and self.buffer_format():
+            import hashlib
+            try:
+                with open(image_file, 'rb') as source:
+                    digest = hashlib.sha1(source.read())
+            except OSError:
+                digest = None
+            if digest:
+                display = pygame.display.get_surface()
+                digest.update(repr((display.get_bitsize(),
+                                    display.get_masks())).encode())
+                cache_file = os.path.join(
+                    self.cache, f'{name}-{digest.hexdigest()[:16]}.raw')
+        self.cache_files[name] = cache_file
+        return cache_file
+
+    def buffer_format(self):
+        """Find the pygame.image.frombuffer() format matching the display.
+
+        Returns:
+            A format string like 'BGRA', or '' if none matches.
+        """
+        if self.cache_format is None:
+            self.cache_format = ''
+            masks = pygame.Surface((1, 1)).convert_alpha().get_masks()
+            for buffer_format in ('BGRA', 'RGBA', 'ARGB'):
+                pixel = pygame.image.frombuffer(bytes(4), (1, 1),
+                                                buffer_format)
+                if pixel.get_masks() == masks:
+                    self.cache_format = buffer_format
+                    break
+        return self.cache_format
+
+    def load_cached(self, name, image_file):
+        """Get a converted image from the cache, skipping the image decoder.
+
+        Args:
+            name: Name of image.
+            image_file: Path to the image file.
+
+        Returns:
+            The converted surface, or None if it is not in the cache.
+        """
+        cache_file = self.cache_file(name, image_file)
+        if not cache_file:
+            return None
+        try:
+            with open(cache_file, 'rb') as cached:
+                data = cached.read()
+            width, height, path = IMAGE_CACHE_HEADER.unpack_from(data)
+            pixels = data[IMAGE_CACHE_HEADER.size:]
+            image = pygame.image.frombuffer(pixels, (width, height),
+                                            self.buffer_format())
+            path = IMAGE_CACHE_PATHS[path]
+        except (OSError, ValueError, IndexError, struct.error):
+            return None
+        if path == 'opaque':
+            image = image.convert()
+        elif path == 'colorkey':
+            image = image.convert()
+            image.set_colorkey(IMAGE_KEY, pygame.RLEACCEL)
+        self.paths[name] = path
+        self.masks[name] = pygame.mask.from_surface(image)
+        return image
+
+    def save_cached(self, name, image_file, image):
+        """Put a converted image in the cache, replacing older versions.
+
+        Args:
+            name: Name of image.
+            image_file: Path to the image file.
+            image: The converted surface.
+        """
+        cache_file = self.cache_file(name, image_file)
+        if not cache_file:
+            return
+        data = IMAGE_CACHE_HEADER.pack(
+            *image.get_size(), IMAGE_CACHE_PATHS.index(self.paths[name]))
+        data += pygame.image.tobytes(image, self.buffer_format())
+        import glob
+        try:
+            os.makedirs(self.cache, exist_ok=True)
+            old_files = os.path.join(glob.escape(self.cache),
+                                     f'{glob.escape(name)}-*.raw')
+            for old_file in glob.glob(old_files):
+                if '-' not in old_file[len(old_files) - 5:]:
+                    os.remove(old_file)
+            with open(cache_file, 'wb') as cached:
+                cached.write(data)
+        except OSError:
+            pass
+
+    def report(self, blits=1000):
+        """Describe how each image was converted and how fast it draws.
+
+        Args:
+            blits: How many times to draw each image for the timing.
+
+        Returns:
+            A string with one line per image.
+        """
+        board = pygame.Surface(BOARD_SIZE).convert()
+        lines = []
+        for name, image in self.store.items():
+            start = time.perf_counter()
+            for _ in range(blits):
+                board.blit(image, (0, 0))
+            lines.append(f'{name:16} {self.paths[name]:8} '
+                         f'{(time.perf_counter() - start) * 1000:.1f} '
+                         f'ms/{blits}')
+        return '\n'.join(lines)
+
+    def get_mask(self, name):
+        """Get the collision mask of an image in the image store.
+
+        The mask is made once, when the image is added.
+
+        Args:
+            name: Name of image (also the file base name).
+
+        Returns:
+            mask object for the image.
+        """
+        self.get(name)
+        return self.masks[name]
+
 
 class SoundStore:
     """Storage for sounds.
@@ -143,14 +455,359 @@ class SoundStore:
         Args:
             name: Name of a file to use as background music.
         """
+        if not pygame.mixer.get_init():
+            return
         sound_file = os.path.join(self.path, f'{name}.{self.ext}')
-        pygame.mixer.music.load(sound_file)
-        pygame.mixer.music.play(-1, 0.0)
+        try:
+            pygame.mixer.music.load(sound_file)
+            pygame.mixer.music.play(-1, 0.0)
+        except pygame.error:
+            print(f'NOTICE: Could not play background music {name}.')
 
     def bg_stop(self):
         """Stop background music.
         """
-        pygame.mixer.music.stop()
+        if pygame.mixer.get_init():
+            pygame.mixer.music.stop()
+
+    def bg_pause(self, paused=True):
+        """Pause or carry on the background music.
+
+        Args:
+            paused: True to pause, False to carry on.
+        """
+        if not pygame.mixer.get_init():
+            return
+        if paused:
+            pygame.mixer.music.pause()
+        else:
+            pygame.mixer.music.unpause()
+
+
+class Display:
+    """The window, and how the board gets onto it.
+
+    The game always draws on a board of BOARD_SIZE, so filling and
+    blitting cost the same whatever the window size. When the window is
+    bigger, the board is an off-screen surface that is scaled up to the
+    window once per frame, or SDL does the scaling with pygame.SCALED.
+    """
+    def __init__(self, scale=1, integer=False, scaled=False,
+                 fullscreen=False):
+        """Open the window.
+
+        Args:
+            scale: How many window pixels to use for each board pixel.
+            integer: Round the scale down to a whole number, so every
+                board pixel is the same size on the window.
+            scaled: Let SDL scale the board with pygame.SCALED instead.
+            fullscreen: Use the whole screen; the scale is then picked to
+                fit it.
+        """
+        flags = pygame.FULLSCREEN if fullscreen else 0
+        self.target = None
+        if scaled:
+            self.window = pygame.display.set_mode(BOARD_SIZE,
+                                                  flags | pygame.SCALED)
+            self.board = self.window
+            return
+        if fullscreen:
+            self.window = pygame.display.set_mode((0, 0), flags)
+            window_width, window_height = self.window.get_size()
+            scale = min(window_width / BOARD_WIDTH,
+                        window_height / BOARD_HEIGHT)
+        if integer:
+            scale = max(1, int(scale))
+        size = round(BOARD_WIDTH * scale), round(BOARD_HEIGHT * scale)
+        if not fullscreen:
+            self.window = pygame.display.set_mode(size)
+        if size == BOARD_SIZE and self.window.get_size() == BOARD_SIZE:
+            self.board = self.window
+            return
+        self.board = pygame.Surface(BOARD_SIZE).convert()
+        self.window.fill((0, 0, 0))
+        area = pygame.Rect((0, 0), size)
+        area.center = self.window.get_rect().center
+        self.target = self.window.subsurface(area)
+
+    def present(self):
+        """Show the board on the window.
+        """
+        if self.target:
+            pygame.transform.scale(self.board, self.target.get_size(),
+                                   self.target)
+        pygame.display.flip()
+
+
+class TextureBoard:
+    """A board that draws through an SDL2 Renderer instead of a Surface.
+
+    It has the Surface methods the game draws with, so it can stand in for
+    BOARD. Each surface is uploaded as a Texture the first time it is
+    blitted and the texture is kept for as long as the surface lives.
+    """
+    def __init__(self, renderer):
+        """Initialize the board.
+
+        Args:
+            renderer: A pygame._sdl2.video.Renderer object.
+        """
+        from pygame._sdl2 import video
+        self.renderer = renderer
+        self.make_texture = video.Texture.from_surface
+        self.textures = weakref.WeakKeyDictionary()
+
+    def get_size(self):
+        return BOARD_SIZE
+
+    def refresh(self, surface, areas=None):
+        """Update a surface's texture after the surface has been drawn on.
+
+        Args:
+            surface: A surface that was blitted before.
+            areas: List of rects that changed, which are the only parts
+                uploaded again, or None to upload all of it next time.
+        """
+        texture = self.textures.get(surface)
+        if texture is None:
+            return
+        if areas is None:
+            del self.textures[surface]
+            return
+        for area in areas:
+            texture.update(surface.subsurface(area), area)
+
+    def blit(self, source, dest, area=None):
+        """Draw a surface on the board.
+
+        Args:
+            source: A surface object.
+            dest: Top-left (x, y) position on the board.
+            area: Part of the surface to draw, or None for all of it.
+        """
+        texture = self.textures.get(source)
+        if texture is None:
+            texture = self.make_texture(self.renderer, source)
+            self.textures[source] = texture
+        if area:
+            area = pygame.Rect(area)
+            texture.draw(srcrect=area, dstrect=(*dest[:2], *area.size))
+        else:
+            texture.draw(dstrect=(*dest[:2], texture.width, texture.height))
+
+    def blits(self, blit_sequence, doreturn=True):
+        """Draw many surfaces on the board.
+
+        Args:
+            blit_sequence: Iterable of (source, dest) or (source, dest,
+                area) tuples.
+            doreturn: Ignored; there are no changed areas to return.
+        """
+        for source, dest, *area in blit_sequence:
+            self.blit(source, dest, *area)
+
+    def fill(self, color, rect=None):
+        """Fill the board, or part of it, with a color.
+
+        Args:
+            color: RGB tuple.
+            rect: Area to fill, or None for the whole board.
+        """
+        self.renderer.draw_color = pygame.Color(color)
+        if rect is None:
+            self.renderer.clear()
+        else:
+            self.renderer.fill_rect(rect)
+
+
+class TextureDisplay:
+    """A window drawn with the SDL2 Renderer, for the Texture backend.
+
+    It works like Display. The renderer is hardware accelerated when it
+    can be and falls back to SDL's software renderer when there is no GPU.
+    """
+    def __init__(self, scale=1, integer=False, fullscreen=False):
+        """Open the window.
+
+        Args:
+            scale: How many window pixels to use for each board pixel.
+            integer: Round the scale down to a whole number.
+            fullscreen: Use the whole screen.
+        """
+        from pygame._sdl2 import video
+        if pygame.display.get_surface() is None:
+            # Surface.convert() needs a display mode, even a hidden one.
+            pygame.display.set_mode((1, 1), pygame.HIDDEN)
+        if integer:
+            scale = max(1, int(scale))
+        size = round(BOARD_WIDTH * scale), round(BOARD_HEIGHT * scale)
+        self.window = video.Window('Skiing', size, fullscreen=fullscreen)
+        try:
+            self.renderer = video.Renderer(self.window, accelerated=1)
+        except video.error:
+            self.renderer = video.Renderer(self.window, accelerated=0)
+        self.renderer.logical_size = BOARD_SIZE
+        self.board = TextureBoard(self.renderer)
+
+    def present(self):
+        """Show the board on the window.
+        """
+        self.renderer.present()
+
+
+class StartupTimer:
+    """Time the steps of starting the game.
+    """
+    def __init__(self):
+        """Start timing.
+        """
+        self.start = self.last = time.perf_counter()
+        self.steps = []
+
+    def mark(self, step):
+        """Record that a step has finished.
+
+        Args:
+            step: Name of the step.
+        """
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def report(self):
+        """Describe how long each step took.
+
+        Returns:
+            A string with one line per step, and a total.
+        """
+        lines = [f'{step:12} {seconds * 1000:7.1f} ms'
+                 for step, seconds in self.steps]
+        lines.append(f'{"total":12} {(self.last - self.start) * 1000:7.1f} ms')
+        return '\n'.join(lines)
+
+
+class FramePacer:
+    """Wait for the next frame, and measure how steady frames are.
+
+    'tick' waits with Clock.tick(), which sleeps and can wake late; 'busy'
+    uses Clock.tick_busy_loop(), which spins the whole time; 'hybrid'
+    sleeps until PACER_SPIN seconds before the frame's deadline and spins
+    for the rest, so it is nearly as steady as 'busy' for little CPU.
+
+    The game steps once per tick, but when presents keep coming late the
+    board is only drawn every divisor ticks, and when the drawn frames fit
+    easily again the divisor comes back down. Intervals between presents
+    go into a histogram with 1 ms buckets for report().
+    """
+    def __init__(self, clock, rate=FRAME_RATE, mode='tick'):
+        """Start pacing.
+
+        Args:
+            clock: A pygame.time.Clock object, ticked in every mode so
+                get_fps() keeps working.
+            rate: Ticks per second.
+            mode: 'tick', 'busy' or 'hybrid'.
+        """
+        self.clock = clock
+        self.rate = rate
+        self.mode = mode
+        self.budget = 1 / rate
+        self.divisor = 1
+        self.ticks = 0
+        self.histogram = collections.Counter()
+        self.presents = 0
+        self.total = self.squares = 0.0  # Sums of intervals, for report()
+        self.changes = 0
+        self.reset()
+
+    def reset(self):
+        """Start timing again, after the game has been paused.
+        """
+        self.clock.tick()
+        self.deadline = self.frame_start = time.perf_counter()
+        self.last_present = None
+        self.late = 0
+        self.worst = 0.0  # Longest drawn frame work in this window
+        self.window = 0
+
+    def render_due(self):
+        """Tell if the board should be drawn this tick.
+
+        Returns:
+            True on every divisor-th tick.
+        """
+        return self.ticks % self.divisor == 0
+
+    def presented(self):
+        """Record that a frame was just presented, and adapt the divisor.
+        """
+        now = time.perf_counter()
+        self.worst = max(self.worst, now - self.frame_start)
+        if self.last_present is not None:
+            interval = now - self.last_present
+            self.histogram[min(int(interval * 1000), PACER_BUCKETS)] += 1
+            self.presents += 1
+            self.total += interval
+            self.squares += interval * interval
+            self.late += interval > self.budget * self.divisor * PACER_LATE
+            self.window += 1
+        self.last_present = now
+        if self.window < PACER_WINDOW:
+            return
+        if (self.late > PACER_MISSES * self.window
+                and self.divisor < PACER_DIVISOR_MAX):
+            self.divisor += 1
+            self.changes += 1
+        elif (self.divisor > 1 and not self.late
+              and self.worst < self.budget * PACER_RECOVER):
+            self.divisor -= 1
+            self.changes += 1
+        self.late = self.window = 0
+        self.worst = 0.0
+
+    def wait(self):
+        """Wait for the next tick.
+
+        Returns:
+            Milliseconds since the last tick, like Clock.tick().
+        """
+        self.ticks += 1
+        if self.mode == 'tick':
+            milliseconds = self.clock.tick(self.rate)
+        elif self.mode == 'busy':
+            milliseconds = self.clock.tick_busy_loop(self.rate)
+        else:
+            self.deadline += self.budget
+            now = time.perf_counter()
+            if now > self.deadline + self.budget:
+                self.deadline = now  # Too far behind to catch up
+            elif self.deadline - now > PACER_SPIN:
+                time.sleep(self.deadline - now - PACER_SPIN)
+            while time.perf_counter() < self.deadline:
+                pass
+            milliseconds = self.clock.tick()
+        self.frame_start = time.perf_counter()
+        return milliseconds
+
+    def report(self):
+        """Describe how steady the presents were.
+
+        Returns:
+            A string with a summary line and a histogram.
+        """
+        if not self.presents:
+            return f'{self.mode} pacing: no frames presented'
+        mean = self.total / self.presents
+        jitter = max(self.squares / self.presents - mean * mean, 0) ** 0.5
+        lines = [f'{self.mode} pacing: {self.presents} presents, mean '
+                 f'{mean * 1000:.2f} ms, jitter {jitter * 1000:.2f} ms, '
+                 f'divisor {self.divisor} after {self.changes} changes']
+        most = max(self.histogram.values())
+        for bucket, count in sorted(self.histogram.items()):
+            bar = '#' * round(count / most * 40)
+            more = '+' if bucket == PACER_BUCKETS else ' '
+            lines.append(f'{bucket:4}{more}ms {count:7} {bar}')
+        return '\n'.join(lines)
 
 
 class Character(pygame.sprite.Sprite):
@@ -165,6 +822,8 @@ class Character(pygame.sprite.Sprite):
         super().__init__()
         self.name = name
         self.image = IMAGES.get(name)
+        self.mask = IMAGES.get_mask(name)
+        self.mask_offset = (0, 0)  # Where the mask is, from rect.topleft
         self.width, self.height = self.image.get_size()
         self.rect = self.image.get_rect()
         self.rect.x = self.rect.y = 0
@@ -192,200 +851,2460 @@ class Player(Character):
             name: Name of character (and image file)
         """
         super().__init__(name)
-        self.image_straight = self.image
-        self.image_left = IMAGES.get(f'{self.name}-sw')
-        self.image_right = IMAGES.get(f'{self.name}-se')
         self.image_shadow = IMAGES.get(f'{self.name}-shadow')
-        self.image_crash = IMAGES.get(f'{self.name}-stunned')
+        self.animations = {
+            'straight': bake_strip([name]),
+            'left': bake_strip([name, f'{name}-sw', f'{name}-w']),
+            'right': bake_strip([name, f'{name}-se', f'{name}-e']),
+            'stunned': bake_wobble(f'{name}-stunned'),
+            'jump': bake_tuck(name),
+            }
+        for animation, strip in self.animations.items():
+            EFFECTS.add(f'{name}-{animation}', strip.strip)
+        self.animation = 'straight'
+        self.animation_ticks = 0
+        self.mask = self.animations['straight'].mask(0)
+        self.mask_offset = self.animations['straight'].offset
+        self.safe_time = 0  # Trees are harmless while this is above 0
         self.score = 0
         self.crashes = 0
         self.crash_time = 0
         self.jumping = False
         self.jump_time = 0
 
-    def draw(self, board):
+    def steer(self, bits):
+        """Set the player's increments from the input bitmask.
+
+        Opposite directions held together cancel out, so letting go of one
+        arrow key while the other is still held keeps moving.
+
+        Args:
+            bits: Input bitmask, from Controls.poll().
+        """
+        self.x_inc = self.speed * (bool(bits & INPUT_RIGHT)
+                                   - bool(bits & INPUT_LEFT))
+        self.y_inc = self.speed * (bool(bits & INPUT_DOWN)
+                                   - bool(bits & INPUT_UP))
+
+    def draw(self, board, camera):
         """Create a draw() method to be consistent with Sprite Groups.
 
         Args:
             board: A surface object (like BOARD)
+            camera: A Camera object.
+        """
+        queue = RenderQueue()
+        self.queue(queue, camera)
+        queue.draw(board)
+
+    def animate(self):
+        """Move the player's animation on by one tick.
+
+        Changing to another animation starts it from its first frame. Also
+        picks the collision mask of the frame queue() will draw, so hits
+        are worked out on the pose that is shown.
         """
         if self.crash_time > 0:
-            image = self.image_crash
+            animation = 'stunned'
+        elif self.jump_time > 0:
+            animation = 'jump'
         elif self.x_inc > 0:
-            image = self.image_right
+            animation = 'right'
         elif self.x_inc < 0:
-            image = self.image_left
+            animation = 'left'
         else:
-            image = self.image_straight
-        board.blit(self.image_shadow, (self.rect.x, self.rect.y))
-        if self.jump_time > 0:
-            y_pos = self.rect.y - self.jump_time
+            animation = 'straight'
+        if animation == self.animation:
+            self.animation_ticks += 1
         else:
-            y_pos = self.rect.y
-        board.blit(image, (self.rect.x, y_pos))
+            self.animation = animation
+            self.animation_ticks = 0
+        strip = self.animations[animation]
+        self.mask = strip.mask(self.animation_ticks)
+        self.mask_offset = strip.offset
 
+    def queue(self, queue, camera):
+        """Add the player's shadow and body to a render queue.
 
-def make_obstacle():
-    """Make an obstacle object.
-    """
-    kind = random.choice(OBSTACLE_CHOICES)
-    obstacle = Character(kind)
-    obstacle.kind = kind
-    obstacle.rect.x = random.randint(0, BOARD_WIDTH - obstacle.width)
-    obstacle.rect.y = random.randint(0, BOARD_HEIGHT) + BOARD_HEIGHT
-    obstacle.y_inc = -obstacle.speed
-    return obstacle
+        Both are sorted by where the skis touch the snow, even in a jump,
+        with the shadow first.
 
+        Args:
+            queue: A RenderQueue object.
+            camera: A Camera object.
+        """
+        x_pos, y_pos = camera.to_board(self.rect)
+        queue.add(self.image_shadow, (x_pos, y_pos), self.rect.bottom)
+        if self.jump_time > 0:
+            y_pos -= self.jump_time
+        animation = self.animations[self.animation]
+        strip = animation.strip
+        key = f'{self.name}-{self.animation}'
+        if self.crash_time > 0:
+            level = EFFECTS.level(self.crash_time / CRASH_TIME)
+            strip = EFFECTS.get(key, 'tint', level)
+        elif self.safe_time > 0 and self.safe_time // BLINK_TICKS % 2:
+            strip = EFFECTS.get(key, 'invert', EFFECTS.levels - 1)
+        x_offset, y_offset = animation.offset
+        queue.add(strip, (x_pos + x_offset, y_pos + y_offset),
+                  self.rect.bottom, animation.frame(self.animation_ticks))
 
-def text2image(text, size=TEXT_SIZE, color=TEXT_COLOR):
-    """Create an image from a text string.
 
-    Args:
-        text: Text to convert to an image.
-        size: Text size, in points.
-        color: RGP tuple, in decimal; example: (255, 0, 255) is magenta.
+class EffectsCache:
+    """Tinted, faded and inverted versions of images, made once.
 
-    Returns:
-        An image object of the specified text.
+    Each effect is made in EFFECT_LEVELS steps from none (level 0) to full,
+    all at once the first time any level of it is asked for. After that,
+    getting a variant is a dictionary lookup, so effects can change every
+    frame without making surfaces in the game loop.
     """
-    font = pygame.font.Font(None, size)
-    image = font.render(text, 1, color)
-    return image
+    def __init__(self, levels=EFFECT_LEVELS):
+        """Initialize an empty cache.
 
+        Args:
+            levels: How many steps to make each effect in.
+        """
+        self.levels = levels
+        self.sources = {}
+        self.variants = {}
 
-def show_stats(score, crashes):
-    """Show player score and crash statistics on the board.
+    def add(self, key, image):
+        """Add an image that is not in the image store, like a strip.
 
-    Args:
-        score: Integer value.
-        crashes: Integer number of crashes the player has had.
-    """
-    text = f'Score: {score}  Crashes: {crashes}/{CRASH_MAX}'
-    text_image = text2image(text)
-    text_width, text_height = text_image.get_size()
-    text_x = 50
-    text_y = BOARD_HEIGHT - text_height
-    BOARD.blit(text_image, (text_x, text_y))
+        Args:
+            key: Name to get the image's variants by.
+            image: A surface object.
+        """
+        self.sources[key] = image
 
+    def get(self, key, effect, level):
+        """Get a variant of an image.
 
-def end_game():
-    """Show game over message.
-    """
-    text_image = text2image('Game Over')
-    text_width, text_height = text_image.get_size()
-    center_x = (BOARD_WIDTH - text_width) // 2
-    center_y = (BOARD_HEIGHT - text_height) // 2
-    BOARD.blit(text_image, (center_x, center_y))
-    pygame.display.flip()
-    SOUNDS.bg_stop()
-    SOUNDS.play('gameover')
-    pygame.time.wait(5 * 1000)
+        Args:
+            key: Name of an image in the image store, or a key passed to
+                add().
+            effect: 'tint', 'fade' or 'invert'.
+            level: How strong the effect is, from 0 to levels - 1.
 
+        Returns:
+            A surface object.
+        """
+        variants = self.variants.get((key, effect))
+        if variants is None:
+            if key in self.sources:
+                source = self.sources[key]
+            else:
+                source = IMAGES.get(key)
+            variants = [self.make(source, effect, level / (self.levels - 1))
+                        for level in range(self.levels)]
+            self.variants[key, effect] = variants
+        return variants[max(0, min(level, self.levels - 1))]
 
-def main():
-    """Does the work.
-    """
-    for image_file in IMAGE_FILES:
-        IMAGES.get(image_file)
+    def level(self, part):
+        """Turn a part from 0 to 1 into the nearest effect level.
 
-    for sound_file in SOUND_FILES:
-        SOUNDS.add(sound_file)
-    SOUNDS.bg_start(BG_MUSIC)
+        Args:
+            part: Float from 0 (no effect) to 1 (full effect).
+        """
+        return round(part * (self.levels - 1))
 
-    player = Player('kiiro')
-    player.rect.x = (BOARD_WIDTH - player.width) // 2
-    player.rect.y = (BOARD_HEIGHT - player.height) // 2
-    player.speed = PLAYER_SPEED
+    @staticmethod
+    def make(source, effect, amount):
+        """Make one variant of an image.
 
-    obstacles = pygame.sprite.Group()
+        Args:
+            source: A surface object.
+            effect: 'tint', 'fade' or 'invert'.
+            amount: How strong the effect is, from 0 to 1.
 
-    game_on = True
-    while game_on:
-        BOARD.fill(BOARD_COLOR)
+        Returns:
+            A surface object with per-pixel alpha.
+        """
+        image = source.convert_alpha()
+        if effect == 'tint':
+            color = [round(255 - (255 - part) * amount) for part in TINT_COLOR]
+            image.fill(color, special_flags=pygame.BLEND_RGB_MULT)
+        elif effect == 'fade':
+            alpha = round(255 * (1 - amount))
+            image.fill((255, 255, 255, alpha),
+                       special_flags=pygame.BLEND_RGBA_MULT)
+        elif effect == 'invert':
+            alpha = image.copy()
+            alpha.fill((255, 255, 255, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            inverted = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+            inverted.fill((255, 255, 255, 255))
+            inverted.blit(image, (0, 0), special_flags=pygame.BLEND_RGB_SUB)
+            inverted.blit(alpha, (0, 0), special_flags=pygame.BLEND_RGBA_MIN)
+            keep = round(255 * (1 - amount))
+            image.fill((keep, keep, keep), special_flags=pygame.BLEND_RGB_MULT)
+            inverted.fill((255 - keep,) * 3,
+                          special_flags=pygame.BLEND_RGB_MULT)
+            image.blit(inverted, (0, 0), special_flags=pygame.BLEND_RGB_ADD)
+        else:
+            raise ValueError(f'Unknown effect {effect}')
+        return image
 
-        for event in pygame.event.get():
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    game_on = False
-                elif event.key == pygame.K_LEFT:
-                    player.x_inc = -player.speed
-                elif event.key == pygame.K_RIGHT:
-                    player.x_inc = player.speed
-                elif event.key == pygame.K_UP:
-                    player.y_inc = -player.speed
-                elif event.key == pygame.K_DOWN:
-                    player.y_inc = player.speed
-            elif event.type == pygame.KEYUP:
-                if event.key in (pygame.K_LEFT, pygame.K_RIGHT):
-                    player.x_inc = 0
-                elif event.key in (pygame.K_UP, pygame.K_DOWN):
-                    player.y_inc = 0
 
-        if player.jumping:
-            player.jump_time += 1
-            if player.jump_time >= JUMP_TIME:
-                player.jumping = False
-        elif player.jump_time > 0:
-            player.jump_time -= 1
+class Animation:
+    """An animation baked into a strip of frames, side by side.
 
-        if player.crash_time > 0:
-            player.crash_time -= 1
+    The strip is made once, when the animation is made, with a collision
+    mask for each frame. Playing it only works out which part of the strip
+    to draw, and which mask to collide with, from the number of ticks it
+    has played, so there are no image lookups or transforms per frame.
+    """
+    def __init__(self, frames, anchor, ticks=ANIMATION_TICKS, loop=False):
+        """Bake frames into a strip.
+
+        Each frame is centred in a cell as big as the biggest frame, with
+        its bottom on the bottom of the cell.
+
+        Args:
+            frames: List of surface objects.
+            anchor: (width, height) of the sprite's rect; the cells are
+                drawn centred on it, bottom edges together.
+            ticks: How many ticks each frame is shown for.
+            loop: Start again after the last frame, instead of staying
+                on it.
+        """
+        self.width = max(frame.get_width() for frame in frames)
+        self.height = max(frame.get_height() for frame in frames)
+        self.count = len(frames)
+        self.ticks = ticks
+        self.loop = loop
+        self.offset = ((anchor[0] - self.width) // 2,
+                       anchor[1] - self.height)
+        size = self.width * self.count, self.height
+        if any(frame.get_flags() & pygame.SRCALPHA for frame in frames):
+            self.strip = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+            self.strip.fill((0, 0, 0, 0))
         else:
-            player.update()
-            obstacles.update()
+            self.strip = pygame.Surface(size).convert()
+            self.strip.fill(IMAGE_KEY)
+            self.strip.set_colorkey(IMAGE_KEY, pygame.RLEACCEL)
+        self.masks = []  # Mask of each frame, the size of a cell
+        for number, frame in enumerate(frames):
+            position = ((self.width - frame.get_width()) // 2,
+                        self.height - frame.get_height())
+            self.strip.blit(frame, (number * self.width + position[0],
+                                    position[1]))
+            mask = pygame.mask.Mask((self.width, self.height))
+            mask.draw(pygame.mask.from_surface(frame), position)
+            self.masks.append(mask)
 
-        if player.rect.x < 0:
-            player.rect.x = 0
-        elif player.rect.x > BOARD_WIDTH - player.width:
-            player.rect.x = BOARD_WIDTH - player.width
-        if player.rect.y < 0:
-            player.rect.y = 0
-        elif player.rect.y > BOARD_HEIGHT - player.height:
-            player.rect.y = BOARD_HEIGHT - player.height
+    def number(self, ticks):
+        """Find which frame is shown.
 
-        if len(obstacles) < OBSTACLES_MAX:
-            obstacle = make_obstacle()
-            obstacles.add(obstacle)
+        Args:
+            ticks: How many ticks the animation has been playing.
 
-        for obstacle in obstacles:
-            if obstacle.rect.y < -obstacle.height:
-                obstacles.remove(obstacle)
+        Returns:
+            Position of the frame in the strip.
+        """
+        number = ticks // self.ticks
+        if self.loop:
+            return number % self.count
+        return min(number, self.count - 1)
 
-        if player.jump_time == 0:
-            hits = pygame.sprite.spritecollide(player, obstacles, dokill=False)
-            for hit in hits:
-                if hit.kind == 'flag':
-                    SOUNDS.play('bonus')
-                    player.score += hit.points
-                    obstacles.remove(hit)
-                elif hit.kind == 'ramp':
-                    SOUNDS.play('jump')
-                    player.score += hit.points
-                    player.jumping = True
-                else:
-                    SOUNDS.play('crash')
-                    player.score -= hit.points
-                    player.crashes += 1
-                    player.crash_time = CRASH_TIME
-                    obstacles.remove(hit)
+    def frame(self, ticks):
+        """Find the part of the strip to draw.
 
-        obstacles.draw(BOARD)
-        player.draw(BOARD)
-        show_stats(player.score, player.crashes)
+        Args:
+            ticks: How many ticks the animation has been playing.
 
-        if player.crashes >= CRASH_MAX:
-            game_on = False
+        Returns:
+            The (x, y, width, height) area of the frame in the strip.
+        """
+        return self.number(ticks) * self.width, 0, self.width, self.height
 
-        pygame.display.flip()
-        CLOCK.tick(FRAME_RATE)
+    def mask(self, ticks):
+        """Find the collision mask of the frame shown.
+
+        Args:
+            ticks: How many ticks the animation has been playing.
+
+        Returns:
+            A Mask object, placed at offset from the sprite's rect.
+        """
+        return self.masks[self.number(ticks)]
+
+
+def bake_strip(names):
+    """Make an animation that steps through images in the image store.
+
+    Args:
+        names: List of image names.
+    """
+    frames = [IMAGES.get(name) for name in names]
+    return Animation(frames, frames[0].get_size())
+
+
+def bake_wobble(name, angles=WOBBLE_ANGLES):
+    """Make a looping animation that rocks an image from side to side.
+
+    Args:
+        name: Name of image.
+        angles: Angle of each frame, in degrees.
+    """
+    image = IMAGES.get(name)
+    frames = [pygame.transform.rotate(image, angle) for angle in angles]
+    return Animation(frames, image.get_size(), loop=True)
+
+
+def bake_tuck(name, scales=TUCK_SCALES):
+    """Make an animation that squashes an image into a tuck.
+
+    Args:
+        name: Name of image.
+        scales: Height of each frame, as a part of the image's height.
+    """
+    image = IMAGES.get(name)
+    width, height = image.get_size()
+    frames = [pygame.transform.scale(image, (width, round(height * scale)))
+              for scale in scales]
+    return Animation(frames, image.get_size())
+
+
+def make_obstacle(kind=None, top=0, rng=random):
+    """Make an obstacle object.
+
+    Args:
+        kind: Kind of obstacle, or None to pick one from OBSTACLE_CHOICES.
+        top: Distance of the top of the board; the obstacle is placed
+            somewhere in the screen below it.
+        rng: Random number generator to place the obstacle with.
+    """
+    if kind is None:
+        kind = rng.choice(OBSTACLE_CHOICES)
+    obstacle = Character(kind)
+    obstacle.kind = kind
+    obstacle.rect.x = rng.randint(0, BOARD_WIDTH - obstacle.width)
+    obstacle.rect.y = rng.randint(0, BOARD_HEIGHT) + BOARD_HEIGHT + top
+    return obstacle
+
+
+class Controls:
+    """Keyboard input, read once per frame as a bitmask.
+
+    Held keys come from pygame.key.get_pressed() through KEY_BINDINGS, and
+    the few keys that only count when they go down come from KEYDOWN
+    events through KEY_PRESSES. All other event types are blocked, so the
+    event queue stays short. The bitmask is a single small integer, which
+    is cheap to record, replay or fake from a bot.
+    """
+    def __init__(self, bindings=KEY_BINDINGS, presses=KEY_PRESSES):
+        """Initialize the controls and filter the event queue.
+
+        Args:
+            bindings: Dictionary of held keys to input bits.
+            presses: Dictionary of pressed keys to input bits.
+        """
+        self.bindings = tuple(bindings.items())
+        self.presses = presses
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(ALLOWED_EVENTS)
+
+    def poll(self):
+        """Read the keyboard.
+
+        Returns:
+            The input bitmask for this frame.
+        """
+        bits = 0
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                bits |= INPUT_QUIT
+            elif event.type == pygame.KEYDOWN:
+                bits |= self.presses.get(event.key, 0)
+        pressed = pygame.key.get_pressed()
+        for key, bit in self.bindings:
+            if pressed[key]:
+                bits |= bit
+        return bits
+
+    def wait(self, timeout=0):
+        """Sleep until a key is pressed, instead of polling.
+
+        Args:
+            timeout: Most milliseconds to wait, or 0 to wait for ever.
+
+        Returns:
+            The input bits of the key that went down (0 for keys with no
+            bits), or None when the wait timed out.
+        """
+        event = pygame.event.wait(timeout)
+        if event.type == pygame.QUIT:
+            return INPUT_QUIT
+        if event.type == pygame.KEYDOWN:
+            return self.presses.get(event.key, 0)
+        return None
+
+
+class Camera:
+    """Camera looking at part of the course.
+
+    Everything on the course has a position in course (world) coordinates,
+    where y is the distance down the hill. Only the camera moves downhill;
+    positions on the board are worked out when things are drawn.
+    """
+    def __init__(self, speed=DOWNHILL_SPEED):
+        """Initialize the camera at the top of the course.
+
+        Args:
+            speed: How many pixels the camera moves down each frame.
+        """
+        self.y = 0
+        self.speed = speed
+
+    @property
+    def bottom(self):
+        """Distance of the bottom edge of the board.
+        """
+        return self.y + BOARD_HEIGHT
+
+    def move(self):
+        """Move the camera down the hill.
+        """
+        self.y += self.speed
+
+    def to_board(self, rect):
+        """Get the board position for a position on the course.
+
+        Args:
+            rect: A rect in course coordinates.
+
+        Returns:
+            The top-left (x, y) position on the board.
+        """
+        return rect.x, rect.y - self.y
+
+
+class Background:
+    """The snowy slope behind everything else.
+
+    The snow texture is drawn once into a tile that repeats down the hill,
+    so each frame only blits it at the camera offset. Ski tracks go on a
+    trail layer that is one board high and used as a ring: course row y is
+    kept in row y % BOARD_HEIGHT, and rows are cleared as they scroll back
+    in at the bottom of the board. The rows that change are remembered, so
+    a texture board only has to upload those.
+    """
+    def __init__(self, seed=0):
+        """Pre-render the snow texture and make an empty trail layer.
+
+        Args:
+            seed: Seed for the snow noise, so the slope looks the same
+                every time.
+        """
+        noise = random.Random(seed)
+        self.tile = pygame.Surface((BOARD_WIDTH, BACKGROUND_TILE)).convert()
+        self.tile.fill(BOARD_COLOR)
+        for _ in range(SNOW_SPECKS):
+            x = noise.randrange(BOARD_WIDTH)
+            y = noise.randrange(BACKGROUND_TILE)
+            self.tile.fill(noise.choice(SNOW_COLORS), (x, y, 2, 1))
+        self.trail = pygame.Surface(BOARD_SIZE).convert()
+        self.trail.fill(TRAIL_KEY)
+        self.trail.set_colorkey(TRAIL_KEY)
+        self.dirty = []  # Trail rects changed since the last draw()
+        self.camera_y = 0
+        self.last_track = None
+
+    def changed(self, rect):
+        """Remember that part of the trail layer changed.
+
+        Args:
+            rect: Rect that was drawn on, which may go past the edges.
+        """
+        rect = rect.clip(self.trail.get_rect())
+        if rect:
+            self.dirty.append(rect)
+
+    def reset(self, camera):
+        """Clear all ski tracks, for when the camera jumps.
+
+        Args:
+            camera: A Camera object.
+        """
+        self.changed(self.trail.fill(TRAIL_KEY))
+        self.camera_y = camera.y
+        self.last_track = None
+
+    def scroll(self, camera):
+        """Clear the trail rows that come back in at the bottom.
+
+        Args:
+            camera: A Camera object.
+        """
+        rows = min(camera.y - self.camera_y, BOARD_HEIGHT)
+        if rows > 0:
+            top = (self.camera_y + BOARD_HEIGHT) % BOARD_HEIGHT
+            self.changed(self.trail.fill(TRAIL_KEY,
+                                         (0, top, BOARD_WIDTH, rows)))
+            if top + rows > BOARD_HEIGHT:
+                self.changed(self.trail.fill(
+                    TRAIL_KEY, (0, 0, BOARD_WIDTH, top + rows - BOARD_HEIGHT)))
+        self.camera_y = camera.y
+
+    def track(self, position):
+        """Add a piece of ski track to the trail layer.
+
+        Args:
+            position: Course (x, y) position of the skis, or None when they
+                are not on the snow.
+        """
+        if position and self.last_track:
+            (x0, y0), (x1, y1) = self.last_track, position
+            y1 += y0 % BOARD_HEIGHT - y0
+            y0 %= BOARD_HEIGHT
+            wraps = [0]
+            if y1 >= BOARD_HEIGHT:
+                wraps.append(-BOARD_HEIGHT)
+            elif y1 < 0:
+                wraps.append(BOARD_HEIGHT)
+            for wrap in wraps:
+                for ski in (-TRACK_GAP // 2, TRACK_GAP // 2):
+                    self.changed(pygame.draw.line(
+                        self.trail, TRACK_COLOR, (x0 + ski, y0 + wrap),
+                        (x1 + ski, y1 + wrap)))
+        self.last_track = position
+
+    def draw(self, board, camera):
+        """Draw the snow and the trail layer.
+
+        Args:
+            board: A surface object (like BOARD)
+            camera: A Camera object.
+        """
+        y = -(camera.y % BACKGROUND_TILE)
+        while y < BOARD_HEIGHT:
+            board.blit(self.tile, (0, y))
+            y += BACKGROUND_TILE
+        if hasattr(board, 'refresh'):
+            board.refresh(self.trail, self.dirty)
+        self.dirty = []
+        y = -(camera.y % BOARD_HEIGHT)
+        board.blit(self.trail, (0, y))
+        board.blit(self.trail, (0, y + BOARD_HEIGHT))
+
+
+class RenderQueue:
+    """Images to draw this frame, drawn back to front in one go.
+
+    Everything is sorted by the course y of its bottom edge, so things
+    further down the hill are drawn over things behind them, and all of
+    it goes to the board in a single blits() call.
+    """
+    def __init__(self):
+        """Initialize an empty queue.
+        """
+        self.items = []
+
+    def add(self, image, position, depth, area=None):
+        """Add an image to draw.
+
+        Images with the same depth are drawn in the order they are added.
+
+        Args:
+            image: A surface object.
+            position: Top-left (x, y) position on the board.
+            depth: Course y of the bottom of the thing drawn.
+            area: Part of the image to draw, or None for all of it.
+        """
+        self.items.append((depth, image, position, area))
+
+    def draw(self, board):
+        """Draw everything in the queue and empty it.
+
+        Args:
+            board: A surface object (like BOARD)
+        """
+        self.items.sort(key=lambda item: item[0])
+        board.blits([(image, position, area) for depth, image, position, area
+                     in self.items], doreturn=False)
+        self.items.clear()
+
+
+class ObstacleField:
+    """Obstacles on the course, split into active and dormant ones.
+
+    Obstacles stay put in course coordinates. Only active obstacles, the
+    ones the camera can see, are sprites that get drawn and tested for
+    collisions. Obstacles further down the course are dormant: they are
+    kept in a heap ordered by distance and made active when the camera
+    reaches them.
+    """
+    def __init__(self):
+        """Initialize an empty obstacle field.
+        """
+        self.active = pygame.sprite.Group()
+        self.dormant = []
+        self.order = 0  # Next heap tie-breaker; keeps entries comparable
+
+    def __len__(self):
+        return len(self.active) + len(self.dormant)
+
+    def add(self, obstacle):
+        """Add an obstacle, placed in course coordinates.
+
+        Args:
+            obstacle: A Character object.
+        """
+        heapq.heappush(self.dormant, (obstacle.rect.y, self.order, obstacle))
+        self.order += 1
+
+    def remove(self, obstacle):
+        """Remove an active obstacle.
+
+        Args:
+            obstacle: A Character object.
+        """
+        self.active.remove(obstacle)
+
+    def between(self, top, bottom):
+        """Find the obstacles that overlap part of the course.
+
+        Args:
+            top: Distance where the part starts.
+            bottom: Distance where the part ends.
+
+        Returns:
+            A list of Character objects.
+        """
+        obstacles = [entry[2] for entry in self.dormant]
+        obstacles.extend(self.active)
+        return [obstacle for obstacle in obstacles
+                if obstacle.rect.bottom > top and obstacle.rect.top < bottom]
+
+    def follow(self, camera):
+        """Wake up obstacles the camera reached and drop ones it passed.
+
+        Args:
+            camera: A Camera object.
+        """
+        while self.dormant and self.dormant[0][0] < camera.bottom:
+            self.active.add(heapq.heappop(self.dormant)[2])
+        for obstacle in self.active:
+            if obstacle.rect.bottom < camera.y:
+                self.active.remove(obstacle)
+
+    def draw(self, board, camera):
+        """Draw the active obstacles.
+
+        Args:
+            board: A surface object (like BOARD)
+            camera: A Camera object.
+        """
+        queue = RenderQueue()
+        self.queue(queue, camera)
+        queue.draw(board)
+
+    def queue(self, queue, camera):
+        """Add the active obstacles to a render queue.
+
+        Args:
+            queue: A RenderQueue object.
+            camera: A Camera object.
+        """
+        for obstacle in self.active:
+            queue.add(obstacle.image, camera.to_board(obstacle.rect),
+                      obstacle.rect.bottom)
+
+    def queue_in_front(self, queue, camera, sprite, area):
+        """Add the active obstacles that cover part of a sprite to a queue.
+
+        This is for when the obstacles were already drawn underneath, for
+        example by a ChunkRenderer, and only the ones further down the hill
+        than the sprite need drawing again on top of it.
+
+        Args:
+            queue: A RenderQueue object.
+            camera: A Camera object.
+            sprite: The sprite that may be covered.
+            area: Rect in course coordinates that the sprite is drawn in.
+        """
+        for obstacle in self.active:
+            if (obstacle.rect.bottom > sprite.rect.bottom
+                    and obstacle.rect.colliderect(area)):
+                queue.add(obstacle.image, camera.to_board(obstacle.rect),
+                          obstacle.rect.bottom)
+
+
+class ChunkRenderer:
+    """Draws obstacles from pre-composited slices of the course.
+
+    Obstacles never move relative to each other, so all the obstacles in a
+    slice of the course, CHUNK_HEIGHT high, are drawn into one chunk image
+    when the slice first shows up. Each frame then blits two or three
+    chunks instead of every obstacle. A chunk is drawn again only after
+    changed() is called for an obstacle in it, when a flag is picked up or
+    a tree is removed after a crash. Game.step() places new obstacles below
+    the chunks on the board, so spawning never draws a chunk again.
+    """
+    def __init__(self):
+        """Initialize with no chunks.
+        """
+        self.chunks = {}  # Slice number: chunk image
+
+    def changed(self, obstacle):
+        """Forget the chunks an added or removed obstacle is in.
+
+        Args:
+            obstacle: A Character object.
+        """
+        first = obstacle.rect.top // CHUNK_HEIGHT
+        last = (obstacle.rect.bottom - 1) // CHUNK_HEIGHT
+        for number in range(first, last + 1):
+            self.chunks.pop(number, None)
+
+    def composite(self, number, field):
+        """Draw all the obstacles in a slice of the course into a chunk.
+
+        Chunks use a colorkey, which blits fast, unless an obstacle image
+        has partly clear pixels that need per-pixel alpha.
+
+        Args:
+            number: Slice number.
+            field: An ObstacleField object.
+
+        Returns:
+            The chunk image.
+        """
+        top = number * CHUNK_HEIGHT
+        obstacles = field.between(top, top + CHUNK_HEIGHT)
+        obstacles.sort(key=lambda obstacle: obstacle.rect.bottom)
+        if any(obstacle.image.get_flags() & pygame.SRCALPHA
+               for obstacle in obstacles):
+            chunk = pygame.Surface((BOARD_WIDTH, CHUNK_HEIGHT),
+                                   pygame.SRCALPHA).convert_alpha()
+            chunk.fill((0, 0, 0, 0))
+        else:
+            chunk = pygame.Surface((BOARD_WIDTH, CHUNK_HEIGHT)).convert()
+            chunk.fill(IMAGE_KEY)
+            chunk.set_colorkey(IMAGE_KEY, pygame.RLEACCEL)
+        chunk.blits([(obstacle.image, (obstacle.rect.x,
+                                       obstacle.rect.y - top))
+                     for obstacle in obstacles], doreturn=False)
+        return chunk
+
+    def draw(self, board, camera, field):
+        """Draw the chunks the camera can see.
+
+        Args:
+            board: A surface object (like BOARD)
+            camera: A Camera object.
+            field: An ObstacleField object.
+        """
+        first = camera.y // CHUNK_HEIGHT
+        last = (camera.bottom - 1) // CHUNK_HEIGHT
+        for number in list(self.chunks):
+            if number < first:
+                del self.chunks[number]
+        for number in range(first, last + 1):
+            if number not in self.chunks:
+                self.chunks[number] = self.composite(number, field)
+            board.blit(self.chunks[number],
+                       (0, number * CHUNK_HEIGHT - camera.y))
+
+
+class ParticleSystem:
+    """Snow spray, crash debris and jump dust.
+
+    Particles live in preallocated NumPy arrays, with a free list of
+    unused slots, so emitting and moving them never makes Python objects
+    per particle. All live particles are moved in a few array operations
+    and drawn as 2x2 dots, straight into the board's pixels when it is a
+    Surface, or with one blits() call otherwise.
+    """
+    def __init__(self, size=PARTICLES_MAX):
+        """Allocate room for particles.
+
+        Raises ImportError when NumPy is not installed.
+
+        Args:
+            size: Most particles alive at once.
+        """
+        import numpy
+        self.numpy = numpy
+        self.random = numpy.random.default_rng()
+        self.position = numpy.zeros((size, 2), numpy.float32)
+        self.velocity = numpy.zeros((size, 2), numpy.float32)
+        self.life = numpy.zeros(size, numpy.int16)  # Frames left; 0 is free
+        self.color = numpy.zeros((size, 3), numpy.uint8)
+        self.free = list(range(size - 1, -1, -1))
+        self.dots = {}  # Color: 2x2 surface, for boards that are not Surfaces
+
+    def __len__(self):
+        return len(self.life) - len(self.free)
+
+    def emit(self, kind, position, direction=(0, 0)):
+        """Start a burst of particles.
+
+        Bursts are cut short when there is no room left.
+
+        Args:
+            kind: (count, speed, life, color) tuple, like SPRAY.
+            position: Course (x, y) position of the burst.
+            direction: (x, y) push added to every particle's velocity.
+        """
+        count, speed, life, color = kind
+        count = min(count, len(self.free))
+        if count == 0:
+            return
+        slots = self.numpy.array(self.free[-count:])
+        del self.free[-count:]
+        angles = self.random.uniform(0, 2 * self.numpy.pi, count)
+        speeds = self.random.uniform(0.3, 1, count) * speed
+        self.position[slots] = position
+        self.velocity[slots, 0] = self.numpy.cos(angles) * speeds
+        self.velocity[slots, 1] = self.numpy.sin(angles) * speeds - speed / 2
+        self.velocity[slots] += direction
+        self.life[slots] = self.random.integers(life // 2, life + 1, count)
+        self.color[slots] = color
+
+    def update(self):
+        """Move the live particles and free the ones that died.
+        """
+        live = self.numpy.flatnonzero(self.life)
+        if len(live) == 0:
+            return
+        self.position[live] += self.velocity[live]
+        self.velocity[live, 1] += PARTICLE_GRAVITY
+        self.life[live] -= 1
+        self.free.extend(live[self.life[live] == 0].tolist())
+
+    def draw(self, board, camera):
+        """Draw the live particles.
+
+        Args:
+            board: A surface object (like BOARD)
+            camera: A Camera object.
+        """
+        numpy = self.numpy
+        live = numpy.flatnonzero(self.life)
+        x = self.position[live, 0].astype(numpy.int32)
+        y = self.position[live, 1].astype(numpy.int32) - camera.y
+        width, height = board.get_size()
+        shown = (x >= 0) & (x < width - 1) & (y >= 0) & (y < height - 1)
+        x, y, live = x[shown], y[shown], live[shown]
+        if not isinstance(board, pygame.Surface):
+            board.blits([(self.dot(tuple(color)), position) for color, position
+                         in zip(self.color[live].tolist(),
+                                zip(x.tolist(), y.tolist()))],
+                        doreturn=False)
+            return
+        pixels = pygame.surfarray.pixels3d(board)
+        colors = self.color[live]
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            pixels[x + dx, y + dy] = colors
+        del pixels
+
+    def dot(self, color):
+        """Get a 2x2 dot image of a color.
+
+        Args:
+            color: RGB tuple.
+        """
+        if color not in self.dots:
+            dot = pygame.Surface((2, 2)).convert()
+            dot.fill(color)
+            self.dots[color] = dot
+        return self.dots[color]
+
+
+class CourseReader:
+    """Read a course file one segment at a time.
+
+    A course file has a header, a segment index keyed by distance and
+    fixed-width obstacle records. Only the index is read when the course
+    is opened; segments are decoded when they are needed and only the
+    last few are kept in memory.
+    """
+    def __init__(self, path, cache_size=COURSE_CACHE):
+        """Open a course file and read its segment index.
+
+        Args:
+            path: Path to the course file.
+            cache_size: How many decoded segments to keep in memory.
+
+        Raises:
+            ValueError: The file is not a course file of this version, or
+                it ends inside its header or index.
+        """
+        self.file = open(path, 'rb')
+        header = self.file.read(COURSE_HEADER.size)
+        if len(header) < COURSE_HEADER.size:
+            self.file.close()
+            raise ValueError(f'{path} is too short for a course file')
+        magic, version, self.segment, count = COURSE_HEADER.unpack(header)
+        if magic != COURSE_MAGIC or version != COURSE_VERSION:
+            self.file.close()
+            raise ValueError(f'{path} is not a version {COURSE_VERSION} '
+                             'course file')
+        index = array.array('I')
+        data = self.file.read(count * COURSE_INDEX.size)
+        if index.itemsize == 4 and len(data) % 4 == 0:
+            index.frombytes(data)
+        if index.itemsize != 4 or len(index) != count * 3:
+            self.file.close()
+            raise ValueError(f'{path} has a broken segment index')
+        if sys.byteorder == 'big':
+            index.byteswap()
+        self.starts = index[0::3]
+        self.offsets = index[1::3]
+        self.counts = index[2::3]
+        if count:
+            self.length = self.starts[-1] + self.segment
+        else:
+            self.length = 0
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+
+    def close(self):
+        """Close the course file.
+        """
+        self.file.close()
+
+    def load(self, number):
+        """Decode one segment, using the cache when possible.
+
+        Args:
+            number: Position of the segment in the index.
+
+        Returns:
+            A list of (kind, x, y) tuples, sorted by y.
+        """
+        if number in self.cache:
+            self.cache.move_to_end(number)
+            return self.cache[number]
+        self.file.seek(self.offsets[number])
+        data = self.file.read(self.counts[number] * COURSE_RECORD.size)
+        records = [(OBSTACLE_KINDS[kind], x, y)
+                   for kind, x, y in COURSE_RECORD.iter_unpack(data)]
+        self.cache[number] = records
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return records
+
+    def records_between(self, top, bottom):
+        """Find the obstacles in part of the course.
+
+        Args:
+            top: Distance where the part starts (included).
+            bottom: Distance where the part ends (not included).
+
+        Returns:
+            A list of (kind, x, y) tuples with top <= y < bottom.
+        """
+        found = []
+        number = max(bisect.bisect_right(self.starts, top) - 1, 0)
+        while number < len(self.starts) and self.starts[number] < bottom:
+            for record in self.load(number):
+                if top <= record[2] < bottom:
+                    found.append(record)
+            number += 1
+        return found
+
+
+def write_course(path, records, segment=COURSE_SEGMENT):
+    """Write obstacles to a course file.
+
+    Args:
+        path: Path to the course file.
+        records: Iterable of (kind, x, y) tuples; y is the distance down
+            the course, in pixels.
+        segment: Distance covered by one segment, in pixels.
+    """
+    segments = {}
+    for kind, x, y in sorted(records, key=lambda record: record[2]):
+        segments.setdefault(y // segment, []).append(
+            COURSE_RECORD.pack(OBSTACLE_KINDS.index(kind), x, y))
+    numbers = sorted(segments)
+    offset = COURSE_HEADER.size + len(numbers) * COURSE_INDEX.size
+    with open(path, 'wb') as course_file:
+        course_file.write(COURSE_HEADER.pack(
+            COURSE_MAGIC, COURSE_VERSION, segment, len(numbers)))
+        for number in numbers:
+            course_file.write(COURSE_INDEX.pack(
+                number * segment, offset, len(segments[number])))
+            offset += len(segments[number]) * COURSE_RECORD.size
+        for number in numbers:
+            course_file.write(b''.join(segments[number]))
+
+
+def compile_course(text_path, path):
+    """Turn a text course into a course file.
+
+    Each line of the text course is "kind x y", for example "flag 200 1500".
+    Blank lines and lines starting with # are skipped.
+
+    Args:
+        text_path: Path to the text course.
+        path: Path to the course file to write.
+    """
+    records = []
+    with open(text_path) as text_file:
+        for line in text_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                kind, x, y = line.split()
+                records.append((kind, int(x), int(y)))
+    write_course(path, records)
+
+
+def sweep_time(rect, dx, dy, other):
+    """Find when a moving rect first touches another rect (swept AABB).
+
+    Args:
+        rect: The rect at the start of the move.
+        dx: How far the rect moves across.
+        dy: How far the rect moves down.
+        other: The rect it may run into, which stays put.
+
+    Returns:
+        (entry, exit) fractions of the move during which the rects
+        overlap, clipped to 0..1, or None if they never overlap.
+    """
+    entry, exit = 0.0, 1.0
+    for start, end, other_start, other_end, move in (
+            (rect.left, rect.right, other.left, other.right, dx),
+            (rect.top, rect.bottom, other.top, other.bottom, dy)):
+        if move == 0:
+            if end <= other_start or other_end <= start:
+                return None
+            continue
+        if move > 0:
+            near, far = other_start - end, other_end - start
+        else:
+            near, far = other_end - start, other_start - end
+        entry = max(entry, near / move)
+        exit = min(exit, far / move)
+    if entry >= exit:
+        return None
+    return entry, exit
+
+
+def sweep_hits(sprite, start, group):
+    """Find what a sprite ran into on its way from start to sprite.rect.
+
+    A test at the end of the move misses thin obstacles when the sprite is
+    fast enough to jump over them in one frame. This sweeps the sprite's
+    rect along the move instead, then checks the masks at a few points
+    between the times the rects first and last overlap.
+
+    Args:
+        sprite: A sprite with rect, mask and mask_offset attributes,
+            already moved.
+        start: The sprite's rect before it moved.
+        group: Sprite group of things that may have been hit.
+
+    Returns:
+        A list of (time, hit) tuples in the order things were touched;
+        time is the fraction of the move at the first mask overlap.
+    """
+    dx = sprite.rect.x - start.x
+    dy = sprite.rect.y - start.y
+    # Sweep the mask's own rect, which can be bigger than the sprite's
+    start = pygame.Rect(start.x + sprite.mask_offset[0],
+                        start.y + sprite.mask_offset[1],
+                        *sprite.mask.get_size())
+    hits = []
+    reach = start.union(start.move(dx, dy))
+    for other in group:
+        if not reach.colliderect(other.rect):
+            continue
+        times = sweep_time(start, dx, dy, other.rect)
+        if times is None:
+            continue
+        entry, exit = times
+        steps = max(1, int(max(abs(dx), abs(dy)) * (exit - entry)
+                           / SWEEP_STEP))
+        for step in range(steps + 1):
+            time = entry + (exit - entry) * step / steps
+            offset = (other.rect.x - round(start.x + dx * time),
+                      other.rect.y - round(start.y + dy * time))
+            if sprite.mask.overlap(other.mask, offset):
+                hits.append((time, other))
+                break
+    hits.sort(key=lambda hit: hit[0])
+    return hits
+
+
+class Leaderboard:
+    """Scores kept in a SQLite database, best first.
+
+    The database is in WAL mode, so reading it never waits for a write.
+    Scores are put on a queue and a background thread writes whatever has
+    piled up in one transaction, so the game loop never waits for the
+    disk. The top entries and each player's best are kept in memory as
+    well, and the leaderboard image is only drawn again when a new score
+    makes the top entries.
+    """
+    def __init__(self, path=LEADERBOARD_FILE, size=LEADERBOARD_SIZE):
+        """Open or create the database and start the writer thread.
+
+        Raises ImportError when Python is built without sqlite3, and
+        sqlite3.Error when the database cannot be opened or read.
+
+        Args:
+            path: Path to the database file.
+            size: Number of top entries to keep and show.
+        """
+        import queue
+        import sqlite3
+        import threading
+
+        self.path = path
+        self.size = size
+        self.connection = sqlite3.connect(path)
+        try:
+            self.open()
+        except sqlite3.Error:
+            self.connection.close()
+            raise
+        self.bests = {}  # Best score of each player asked about
+        self.image = None  # Drawn top entries, or None when out of date
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self.write, args=(sqlite3,),
+                                       name='leaderboard', daemon=True)
+        self.writer.start()
+
+    def open(self):
+        """Set up the database and read the top entries.
+        """
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS scores (id INTEGER PRIMARY KEY, '
+                'player TEXT NOT NULL, score INTEGER NOT NULL, '
+                'crashes INTEGER NOT NULL, seed INTEGER, played REAL)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS scores_by_score '
+                'ON scores (score DESC)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS scores_by_player '
+                'ON scores (player, score DESC)')
+        self.top = self.connection.execute(
+            'SELECT player, score, crashes FROM scores '
+            'ORDER BY score DESC, id LIMIT ?', (self.size,)).fetchall()
+
+    def write(self, sqlite3):
+        """Write queued scores in batches, until close() is called.
+
+        Runs on the writer thread, with its own connection.
+
+        Args:
+            sqlite3: The sqlite3 module.
+        """
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while len(batch) < LEADERBOARD_BATCH and not self.queue.empty():
+                batch.append(self.queue.get())
+            if None in batch:
+                done = True
+                batch = [row for row in batch if row is not None]
+            with connection:
+                connection.executemany(
+                    'INSERT INTO scores (player, score, crashes, seed, '
+                    'played) VALUES (?, ?, ?, ?, ?)', batch)
+        connection.close()
+
+    def add(self, player, score, crashes, seed=None):
+        """Queue a score to be written.
+
+        Args:
+            player: Name of the player.
+            score: Final score.
+            crashes: Number of crashes.
+            seed: Seed of the game, or None.
+        """
+        best = self.best(player)
+        self.queue.put((player, score, crashes, seed, time.time()))
+        self.bests[player] = score if best is None else max(best, score)
+        if len(self.top) < self.size or score > self.top[-1][1]:
+            ranks = [-entry[1] for entry in self.top]
+            self.top.insert(bisect.bisect_right(ranks, -score),
+                            (player, score, crashes))
+            del self.top[self.size:]
+            self.image = None
+
+    def best(self, player):
+        """Find the best score of a player.
+
+        Args:
+            player: Name of the player.
+
+        Returns:
+            The best score, or None when the player has no scores.
+        """
+        if player not in self.bests:
+            self.bests[player] = self.connection.execute(
+                'SELECT MAX(score) FROM scores WHERE player = ?',
+                (player,)).fetchone()[0]
+        return self.bests[player]
+
+    def draw(self):
+        """Get an image of the top entries, drawing it if it is out of date.
+
+        Returns:
+            A Surface object.
+        """
+        if self.image is None:
+            lines = [text2image('Best scores', LEADERBOARD_TEXT)]
+            for rank, (player, score, crashes) in enumerate(self.top, 1):
+                lines.append(text2image(f'{rank:2}. {player}  {score}',
+                                        LEADERBOARD_TEXT))
+            width = max(line.get_width() for line in lines)
+            height = sum(line.get_height() for line in lines)
+            self.image = pygame.Surface((width, height), pygame.SRCALPHA)
+            y = 0
+            for line in lines:
+                self.image.blit(line, (0, y))
+                y += line.get_height()
+        return self.image
+
+    def close(self):
+        """Write the scores still queued and close the database.
+        """
+        self.queue.put(None)
+        self.writer.join()
+        self.connection.close()
+
+
+class Telemetry:
+    """Game events and frame times, written to compressed log files.
+
+    The game loop only puts records in a ring buffer. It has one writer,
+    the game loop, which moves head, and one reader, the drain thread,
+    which moves tail, so neither needs a lock; when the buffer is full
+    new records are counted and dropped rather than waited for, and the
+    count is logged. Every TELEMETRY_INTERVAL seconds the drain thread
+    turns the records into JSON lines and writes them to gzip files,
+    starting a new file every TELEMETRY_ROTATE bytes and deleting all but
+    the last TELEMETRY_KEEP.
+    """
+    def __init__(self, path, size=TELEMETRY_SIZE):
+        """Make the log folder and start the drain thread.
+
+        Args:
+            path: Folder for the log files.
+            size: Records the ring buffer holds.
+        """
+        import threading
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.size = size
+        self.slots = [None] * size
+        self.head = 0  # Records ever put in; only log() changes it
+        self.tail = 0  # Records ever taken out; only drain() changes it
+        self.dropped = 0  # Records log() had no room for
+        self.reported = 0  # Dropped records already written to the log
+        self.name = time.strftime('telemetry-%Y%m%d-%H%M%S')
+        self.part = 0
+        self.file = None
+        self.written = 0
+        self.stop = threading.Event()
+        self.drainer = threading.Thread(target=self.run, name='telemetry',
+                                        daemon=True)
+        self.drainer.start()
+
+    def log(self, event, **fields):
+        """Put a record in the ring buffer.
+
+        Args:
+            event: Name of the event, like 'crash' or 'frame'.
+            **fields: Values to log with it.
+        """
+        if self.head - self.tail >= self.size:
+            self.dropped += 1
+            return
+        self.slots[self.head % self.size] = (time.time(), event, fields)
+        self.head += 1
+
+    def run(self):
+        """Drain the ring buffer until close() is called.
+
+        Runs on the drain thread.
+        """
+        while not self.stop.wait(TELEMETRY_INTERVAL):
+            self.drain()
+        self.drain()
+        if self.file:
+            self.file.close()
+
+    def drain(self):
+        """Write out the records in the ring buffer.
+        """
+        import json
+
+        lines = []
+        while self.tail < self.head:
+            index = self.tail % self.size
+            when, event, fields = self.slots[index]
+            self.slots[index] = None
+            self.tail += 1
+            lines.append(json.dumps({'time': round(when, 4),
+                                     'event': event, **fields}))
+        if self.dropped > self.reported:
+            lines.append(json.dumps({
+                'time': round(time.time(), 4), 'event': 'dropped',
+                'records': self.dropped - self.reported}))
+            self.reported = self.dropped
+        if not lines:
+            return
+        data = ('\n'.join(lines) + '\n').encode()
+        if self.file is None or self.written >= TELEMETRY_ROTATE:
+            self.rotate()
+        self.file.write(data)
+        self.written += len(data)
+
+    def rotate(self):
+        """Start a new log file and delete the oldest ones.
+        """
+        import gzip
+
+        if self.file:
+            self.file.close()
+        self.part += 1
+        self.file = gzip.open(os.path.join(
+            self.path, f'{self.name}-{self.part:03}.jsonl.gz'), 'wb')
+        self.written = 0
+        logs = sorted(name for name in os.listdir(self.path)
+                      if name.startswith('telemetry-')
+                      and name.endswith('.jsonl.gz'))
+        for name in logs[:-TELEMETRY_KEEP]:
+            os.remove(os.path.join(self.path, name))
+
+    def close(self):
+        """Write what is left and stop the drain thread.
+        """
+        self.stop.set()
+        self.drainer.join()
+
+
+class Metrics:
+    """Live game and frame numbers, served to Prometheus over HTTP.
+
+    The game loop only stores numbers: tick times go into a fixed ring of
+    the last METRICS_WINDOW ticks, present times into a short deque, and
+    the game state is replaced as one tuple, so a scrape never sees half
+    of an update. Percentiles and the
+    Prometheus text are only worked out when a scrape comes in, on the
+    server's own thread, so the game pays almost nothing when nobody is
+    looking.
+    """
+    def __init__(self, port, host=METRICS_HOST, window=METRICS_WINDOW):
+        """Start serving /metrics on a background thread.
+
+        Args:
+            port: TCP port to listen on.
+            host: Address to listen on.
+            window: Recent ticks that percentiles cover.
+        """
+        import http.server
+        import threading
+
+        self.ticks = 0
+        self.frames = 0  # Frames presented; the pacer can skip ticks
+        self.present_times = collections.deque(maxlen=METRICS_FPS_FRAMES)
+        self.frame_seconds = 0.0  # Sum of all frame times
+        self.work_seconds = 0.0  # Sum of all work times
+        self.frame_times = array.array('d', [0.0] * window)
+        self.work_times = array.array('d', [0.0] * window)
+        self.events = collections.Counter()
+        self.state = (0, 0, 0, 0, 0, 0)
+        # tick, score, crashes, active obstacles, dormant obstacles,
+        # live particles
+
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.HTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='metrics', daemon=True)
+        self.thread.start()
+
+    def tick(self, work_time, frame_time):
+        """Count a tick of the game loop, whether it was drawn or not.
+
+        Args:
+            work_time: Seconds spent on the tick, not counting the wait.
+            frame_time: Seconds from the last tick to this one.
+        """
+        slot = self.ticks % len(self.frame_times)
+        self.frame_times[slot] = frame_time
+        self.work_times[slot] = work_time
+        self.frame_seconds += frame_time
+        self.work_seconds += work_time
+        self.ticks += 1
+
+    def presented(self):
+        """Count a frame that was just presented.
+        """
+        self.present_times.append(time.perf_counter())
+        self.frames += 1
+
+    def fps(self):
+        """Work out the presented frame rate.
+
+        Returns:
+            Frames per second over the last METRICS_FPS_FRAMES frames, or
+            0.0 before there are two.
+        """
+        times = tuple(self.present_times)
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def quantiles(self, times):
+        """Work out percentiles of the recent frames.
+
+        Args:
+            times: frame_times or work_times.
+
+        Returns:
+            A list of (quantile, seconds) tuples.
+        """
+        recent = sorted(times[:min(self.ticks, len(times))])
+        if not recent:
+            return [(quantile, 0.0) for quantile in METRICS_QUANTILES]
+        return [(quantile, recent[min(int(quantile * len(recent)),
+                                      len(recent) - 1)])
+                for quantile in METRICS_QUANTILES]
+
+    def render(self):
+        """Write the metrics in the Prometheus text format.
+
+        Returns:
+            The text.
+        """
+        tick, score, crashes, active, dormant, particles = self.state
+        ticks = self.ticks
+        lines = []
+
+        def add(name, kind, text, samples):
+            lines.append(f'# HELP skis_{name} {text}')
+            lines.append(f'# TYPE skis_{name} {kind}')
+            for labels, value in samples:
+                lines.append(f'skis_{name}{labels} {value}')
+
+        add('frames_total', 'counter', 'Frames presented.',
+            [('', self.frames)])
+        add('fps', 'gauge', 'Frames presented per second, over the last '
+            f'{METRICS_FPS_FRAMES} frames.', [('', round(self.fps(), 2))])
+        add('ticks_total', 'counter', 'Game loop ticks.', [('', ticks)])
+        add('render_divisor', 'gauge',
+            'Ticks per presented frame the pacer aims for.',
+            [('', PACER.divisor)])
+        for name, times, total, text in (
+                ('frame_seconds', self.frame_times, self.frame_seconds,
+                 'Time from one tick to the next.'),
+                ('work_seconds', self.work_times, self.work_seconds,
+                 'Time spent on a tick, not counting the wait.')):
+            add(name, 'summary', text,
+                [(f'{{quantile="{quantile}"}}', seconds)
+                 for quantile, seconds in self.quantiles(times)]
+                + [('_sum', total), ('_count', ticks)])
+        add('tick', 'gauge', 'Game tick.', [('', tick)])
+        add('score', 'gauge', 'Score of the game being played.',
+            [('', score)])
+        add('crashes', 'gauge', 'Crashes in the game being played.',
+            [('', crashes)])
+        add('events_total', 'counter', 'Game events by kind.',
+            [(f'{{event="{event}"}}', count)
+             for event, count in sorted(self.events.items())])
+        add('obstacles', 'gauge', 'Obstacles in the obstacle field.',
+            [('{state="active"}', active), ('{state="dormant"}', dormant)])
+        add('particles', 'gauge', 'Live particles.', [('', particles)])
+        add('particles_max', 'gauge', 'Room in the particle pool.',
+            [('', PARTICLES_MAX)])
+        text_cache = text2image.cache_info()
+        add('cache_entries', 'gauge', 'Entries in each asset cache.',
+            [('{cache="images"}', len(IMAGES.store)),
+             ('{cache="effects"}', len(EFFECTS.variants)),
+             ('{cache="text"}', text_cache.currsize),
+             ('{cache="course"}', len(COURSE.cache) if COURSE else 0)])
+        add('text_cache_total', 'counter', 'Text image cache lookups.',
+            [('{result="hit"}', text_cache.hits),
+             ('{result="miss"}', text_cache.misses)])
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        """Stop serving.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@functools.lru_cache(maxsize=32)
+def text2image(text, size=TEXT_SIZE, color=TEXT_COLOR):
+    """Create an image from a text string.
+
+    Images are cached, so text that does not change is only rendered once.
+
+    Args:
+        text: Text to convert to an image.
+        size: Text size, in points.
+        color: RGP tuple, in decimal; example: (255, 0, 255) is magenta.
+
+    Returns:
+        An image object of the specified text.
+    """
+    font = pygame.font.Font(None, size)
+    image = font.render(text, 1, color)
+    return image
+
+
+def show_stats(board, score, crashes):
+    """Show player score and crash statistics on the board.
+
+    Args:
+        board: A surface object (like BOARD)
+        score: Integer value.
+        crashes: Integer number of crashes the player has had.
+    """
+    text = f'Score: {score}  Crashes: {crashes}/{CRASH_MAX}'
+    text_image = text2image(text)
+    text_width, text_height = text_image.get_size()
+    text_x = 50
+    text_y = BOARD_HEIGHT - text_height
+    board.blit(text_image, (text_x, text_y))
+
+
+def show_attract():
+    """Show the attract screen, for a kiosk nobody is playing at.
+    """
+    BOARD.fill(BOARD_COLOR)
+    text_image = text2image('Press any key')
+    text_width, text_height = text_image.get_size()
+    center_y = (BOARD_HEIGHT - text_height) // 2
+    BOARD.blit(text_image, ((BOARD_WIDTH - text_width) // 2, center_y))
+    if LEADERBOARD:
+        scores_image = LEADERBOARD.draw()
+        BOARD.blit(scores_image, ((BOARD_WIDTH - scores_image.get_width())
+                                  // 2, center_y + text_height))
+    DISPLAY.present()
+
+
+def pause_game(controls):
+    """Hold the game still until it is unpaused, using next to no CPU.
+
+    The frame on the board is shown once more with a Paused sign, and
+    then the game sleeps in pygame.event.wait() until a key goes down.
+    After PAUSE_ATTRACT seconds the attract screen is shown instead, and
+    from there any key goes back to the game.
+
+    Args:
+        controls: A Controls object.
+
+    Returns:
+        False when the player quit while paused, otherwise True.
+    """
+    SOUNDS.play('pause')
+    SOUNDS.bg_pause()
+    text_image = text2image('Paused')
+    text_width, text_height = text_image.get_size()
+    BOARD.blit(text_image, ((BOARD_WIDTH - text_width) // 2,
+                            (BOARD_HEIGHT - text_height) // 2))
+    DISPLAY.present()
+    attract_at = time.perf_counter() + PAUSE_ATTRACT
+    attract = False
+    while True:
+        if attract:
+            timeout = 0
+        else:
+            timeout = max(1, round((attract_at - time.perf_counter())
+                                   * 1000))
+        bits = controls.wait(timeout)
+        if bits is None:
+            if not attract:
+                attract = True
+                show_attract()
+        elif bits & INPUT_QUIT:
+            return False
+        elif bits & INPUT_PAUSE or attract:
+            break
+    SOUNDS.bg_pause(False)
+    return True
+
+
+def end_game():
+    """Show game over message, and the leaderboard when there is one.
+    """
+    text_image = text2image('Game Over')
+    text_width, text_height = text_image.get_size()
+    center_x = (BOARD_WIDTH - text_width) // 2
+    center_y = (BOARD_HEIGHT - text_height) // 2
+    BOARD.blit(text_image, (center_x, center_y))
+    if LEADERBOARD:
+        scores_image = LEADERBOARD.draw()
+        BOARD.blit(scores_image, ((BOARD_WIDTH - scores_image.get_width())
+                                  // 2, center_y + text_height))
+        best = LEADERBOARD.best(PLAYER_NAME)
+        if best is not None:
+            best_image = text2image(f'{PLAYER_NAME} best: {best}',
+                                    LEADERBOARD_TEXT)
+            BOARD.blit(best_image, ((BOARD_WIDTH - best_image.get_width())
+                                    // 2, center_y - best_image.get_height()))
+    DISPLAY.present()
+    SOUNDS.bg_stop()
+    SOUNDS.play('gameover')
+    pygame.time.wait(5 * 1000)
+
+
+class Game:
+    """One run down the hill: the state of the game and its rules.
+
+    Everything that decides the score is in here, moved on one frame at a
+    time by step() from the input bitmask alone, so a game can be saved,
+    restored and played again from its inputs. Sounds, particles and
+    drawing are left to the caller, which gets a list of events from each
+    step.
+    """
+    def __init__(self, seed=None, course=None):
+        """Start a new game.
+
+        Args:
+            seed: Seed for placing obstacles, or None for a random one.
+            course: A CourseReader object, or None for random obstacles.
+        """
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.course = course
+        self.course_spawned = 0  # How far down the course obstacles are made
+        self.tick = 0
+        self.over = False
+        self.player = Player('kiiro')
+        self.player.rect.x = (BOARD_WIDTH - self.player.width) // 2
+        self.player.rect.y = (BOARD_HEIGHT - self.player.height) // 2
+        self.player.speed = PLAYER_SPEED
+        self.camera = Camera()
+        self.obstacles = ObstacleField()
+
+    def step(self, bits):
+        """Move the game on by one frame.
+
+        Args:
+            bits: Input bitmask for this frame, from Controls.poll().
+
+        Returns:
+            A list of (event, obstacle) tuples for what happened, where
+            event is 'spawn', 'flag', 'ramp', 'crash', 'turn' or 'land';
+            obstacle is None for 'turn' and 'land'.
+        """
+        player, camera, obstacles = self.player, self.camera, self.obstacles
+        events = []
+        self.tick += 1
+        last_x_inc = player.x_inc
+        player.steer(bits)
+
+        last_jump_time = player.jump_time
+        if player.jumping:
+            player.jump_time += 1
+            if player.jump_time >= JUMP_TIME:
+                player.jumping = False
+        elif player.jump_time > 0:
+            player.jump_time -= 1
+
+        start = player.rect.copy()
+        if player.safe_time > 0:
+            player.safe_time -= 1
+        if player.crash_time > 0:
+            player.crash_time -= 1
+        else:
+            camera.move()
+            player.update()
+            player.rect.y += camera.speed
+
+        if player.rect.x < 0:
+            player.rect.x = 0
+        elif player.rect.x > BOARD_WIDTH - player.width:
+            player.rect.x = BOARD_WIDTH - player.width
+        if player.rect.y < camera.y:
+            player.rect.y = camera.y
+        elif player.rect.y > camera.bottom - player.height:
+            player.rect.y = camera.bottom - player.height
+        player.animate()
+
+        if self.course:
+            course_end = camera.y + 2 * BOARD_HEIGHT
+            for kind, x, y in self.course.records_between(
+                    self.course_spawned, course_end):
+                obstacle = make_obstacle(kind)
+                obstacle.rect.x = x
+                obstacle.rect.y = y
+                obstacles.add(obstacle)
+                events.append(('spawn', obstacle))
+            self.course_spawned = course_end
+            if camera.y >= self.course.length:
+                self.over = True
+        elif len(obstacles) < OBSTACLES_MAX:
+            # Start below the last chunk on the board, so a new obstacle
+            # never lands in a chunk ChunkRenderer has drawn already.
+            below = -(-camera.bottom // CHUNK_HEIGHT) * CHUNK_HEIGHT
+            obstacle = make_obstacle(top=below - BOARD_HEIGHT,
+                                     rng=self.random)
+            obstacles.add(obstacle)
+            events.append(('spawn', obstacle))
+        obstacles.follow(camera)
+
+        if player.jump_time == 0:
+            for hit_time, hit in sweep_hits(player, start,
+                                            obstacles.active):
+                if hit.kind == 'flag':
+                    player.score += hit.points
+                    obstacles.remove(hit)
+                    events.append(('flag', hit))
+                elif hit.kind == 'ramp':
+                    player.score += hit.points
+                    player.jumping = True
+                    events.append(('ramp', hit))
+                    break
+                elif player.safe_time == 0:
+                    player.score -= hit.points
+                    player.crashes += 1
+                    player.crash_time = CRASH_TIME
+                    player.safe_time = CRASH_TIME + SAFE_TIME
+                    obstacles.remove(hit)
+                    events.append(('crash', hit))
+                    player.rect.x += round((start.x - player.rect.x)
+                                           * (1 - hit_time))
+                    player.rect.y = max(camera.y, player.rect.y + round(
+                        (start.y - player.rect.y) * (1 - hit_time)))
+                    break
+
+        if player.jump_time == 0 and player.crash_time == 0:
+            if player.x_inc != last_x_inc and player.x_inc:
+                events.append(('turn', None))
+            if last_jump_time > 0:
+                events.append(('land', None))
+
+        if player.crashes >= CRASH_MAX:
+            self.over = True
+        return events
+
+    def snapshot(self):
+        """Pack the state of the game into bytes.
+
+        Returns:
+            A bytes object for restore().
+        """
+        player, camera, obstacles = self.player, self.camera, self.obstacles
+        parts = [
+            SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.tick, self.seed,
+                camera.y, camera.speed, self.course_spawned, obstacles.order,
+                len(obstacles.active), len(obstacles.dormant)),
+            SNAPSHOT_PLAYER.pack(
+                player.rect.x, player.rect.y, player.x_inc, player.y_inc,
+                player.speed, player.score, player.crashes,
+                player.crash_time, player.jump_time, player.safe_time,
+                player.jumping, list(player.animations).index(
+                    player.animation), player.animation_ticks),
+            ]
+        kinds = {kind: code for code, kind in enumerate(OBSTACLE_KINDS)}
+        records = []
+        for obstacle in obstacles.active:
+            records += (kinds[obstacle.kind], obstacle.rect.x,
+                        obstacle.rect.y, obstacle.x_inc, obstacle.y_inc, 0)
+        for y, order, obstacle in obstacles.dormant:
+            records += (kinds[obstacle.kind], obstacle.rect.x,
+                        obstacle.rect.y, obstacle.x_inc, obstacle.y_inc, order)
+        count = len(obstacles.active) + len(obstacles.dormant)
+        parts.append(struct.pack(
+            '<' + SNAPSHOT_OBSTACLE.format[1:] * count, *records))
+        version, state, gauss_next = self.random.getstate()
+        parts.append(SNAPSHOT_RANDOM.pack(*state, gauss_next is not None,
+                                          gauss_next or 0.0))
+        return b''.join(parts)
+
+    def restore(self, data):
+        """Put the game back in a state from snapshot().
+
+        Raises ValueError, leaving the game as it was, when data is not a
+        whole snapshot of this version.
+
+        Args:
+            data: A bytes object from snapshot().
+        """
+        if len(data) < SNAPSHOT_HEADER.size:
+            raise ValueError('Snapshot is too short for its header')
+        (magic, version, tick, seed, camera_y, camera_speed, course_spawned,
+         next_order, active, dormant) = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f'Not a version {SNAPSHOT_VERSION} snapshot')
+        size = (SNAPSHOT_HEADER.size + SNAPSHOT_PLAYER.size
+                + (active + dormant) * SNAPSHOT_OBSTACLE.size
+                + SNAPSHOT_RANDOM.size)
+        if len(data) != size:
+            raise ValueError(f'Snapshot is {len(data)} bytes, but its '
+                             f'header needs {size}')
+        offset = SNAPSHOT_HEADER.size
+        player_state = SNAPSHOT_PLAYER.unpack_from(data, offset)
+        offset += SNAPSHOT_PLAYER.size
+        records = list(SNAPSHOT_OBSTACLE.iter_unpack(
+            data[offset:offset + (active + dormant) * SNAPSHOT_OBSTACLE.size]))
+        offset += (active + dormant) * SNAPSHOT_OBSTACLE.size
+        *state, has_gauss, gauss_next = SNAPSHOT_RANDOM.unpack_from(data,
+                                                                   offset)
+        # Check everything before changing anything.
+        player = self.player
+        animation = player_state[11]
+        if animation >= len(player.animations):
+            raise ValueError(f'Snapshot has unknown animation {animation}')
+        for record in records:
+            if record[0] >= len(OBSTACLE_KINDS):
+                raise ValueError(f'Snapshot has unknown obstacle kind '
+                                 f'{record[0]}')
+        if state[-1] > len(state) - 1:
+            raise ValueError('Snapshot has a broken random state')
+        self.tick, self.seed, self.course_spawned = tick, seed, course_spawned
+        self.camera.y, self.camera.speed = camera_y, camera_speed
+        (player.rect.x, player.rect.y, player.x_inc, player.y_inc,
+         player.speed, player.score, player.crashes, player.crash_time,
+         player.jump_time, player.safe_time, player.jumping, animation,
+         player.animation_ticks) = player_state
+        player.animation = list(player.animations)[animation]
+        strip = player.animations[player.animation]
+        player.mask = strip.mask(player.animation_ticks)
+        player.mask_offset = strip.offset
+        # Obstacle objects are reused, because making them is the slow part.
+        spare = {kind: [] for kind in OBSTACLE_KINDS}
+        for obstacle in self.obstacles.active:
+            spare[obstacle.kind].append(obstacle)
+        for y, order, obstacle in self.obstacles.dormant:
+            spare[obstacle.kind].append(obstacle)
+        self.obstacles.active.empty()
+        self.obstacles = obstacles = ObstacleField()
+        awake = []
+        for kind, x, y, x_inc, y_inc, order in records:
+            kind = OBSTACLE_KINDS[kind]
+            if spare[kind]:
+                obstacle = spare[kind].pop()
+            else:
+                obstacle = Character(kind)
+                obstacle.kind = kind
+            obstacle.rect.topleft = x, y
+            obstacle.x_inc, obstacle.y_inc = x_inc, y_inc
+            if len(awake) < active:
+                awake.append(obstacle)
+            else:
+                obstacles.dormant.append((y, order, obstacle))
+        obstacles.active.add(*awake)
+        obstacles.order = next_order
+        self.random.setstate((3, tuple(state),
+                              gauss_next if has_gauss else None))
+        self.over = False
+
+
+class Replay:
+    """A recorded game: its seed, its inputs and keyframes to seek with.
+
+    Inputs are kept one byte per tick and written as runs of the same
+    bits, which is what holding a key looks like. Every REPLAY_KEYFRAME
+    ticks a full Game snapshot is kept as well, so seeking restores the
+    nearest keyframe before the tick, found with bisect, and simulates at
+    most REPLAY_KEYFRAME ticks from there. A game played on a course file
+    needs the same course to play back.
+    """
+    def __init__(self, seed, first=0, interval=REPLAY_KEYFRAME):
+        """Start an empty replay.
+
+        Args:
+            seed: Seed of the recorded game.
+            first: Tick the recording starts at.
+            interval: Ticks between keyframes.
+        """
+        self.seed = seed
+        self.first = first
+        self.interval = interval
+        self.inputs = bytearray()  # Input bits for each tick from first
+        self.ticks = []  # Tick of each keyframe, in order
+        self.keyframes = []  # Game snapshots matching self.ticks
+        self.score = self.crashes = 0  # Result claimed by the recorder
+
+    @property
+    def last(self):
+        """Tick the recording ends at."""
+        return self.first + len(self.inputs)
+
+    def record(self, game, bits):
+        """Add one tick of input, taking a keyframe when one is due.
+
+        Call this just before game.step(bits).
+
+        Args:
+            game: The Game object being recorded.
+            bits: Input bitmask for this tick; only the INPUT_STEER bits
+                are kept, as the others do not change the game.
+        """
+        if len(self.inputs) % self.interval == 0:
+            self.ticks.append(game.tick)
+            self.keyframes.append(game.snapshot())
+        self.inputs.append(bits & INPUT_STEER)
+
+    def bits(self, tick):
+        """Get the recorded input for one tick.
+
+        Args:
+            tick: Game tick, from first up to (not including) last.
+
+        Returns:
+            The input bitmask.
+        """
+        return self.inputs[tick - self.first]
+
+    def seek(self, game, tick):
+        """Bring a game to a tick of the recording.
+
+        When the game is already between the right keyframe and the tick
+        it is simulated on from where it is, so short seeks forward do not
+        go back to a keyframe.
+
+        Args:
+            game: A Game object.
+            tick: Tick to go to; it is clamped to the recording.
+        """
+        if not self.ticks:
+            return
+        tick = min(max(tick, self.first), self.last)
+        number = bisect.bisect_right(self.ticks, tick) - 1
+        if not self.ticks[number] <= game.tick <= tick:
+            game.restore(self.keyframes[number])
+        while game.tick < tick:
+            game.step(self.inputs[game.tick - self.first])
+
+    def save(self, path):
+        """Write the replay to a file.
+
+        Args:
+            path: Path to the replay file.
+        """
+        runs = []
+        for bits, group in itertools.groupby(self.inputs):
+            count = sum(1 for _ in group)
+            while count > 0:
+                runs += (bits, min(count, 0xffff))
+                count -= 0xffff
+        offset = (REPLAY_HEADER.size + len(self.ticks) * REPLAY_INDEX.size
+                  + len(runs) // 2 * REPLAY_RUN.size)
+        with open(path, 'wb') as replay_file:
+            replay_file.write(REPLAY_HEADER.pack(
+                REPLAY_MAGIC, REPLAY_VERSION, self.seed, self.first,
+                len(self.ticks), len(runs) // 2, self.score, self.crashes))
+            for tick, keyframe in zip(self.ticks, self.keyframes):
+                replay_file.write(REPLAY_INDEX.pack(tick, offset,
+                                                    len(keyframe)))
+                offset += len(keyframe)
+            replay_file.write(struct.pack(
+                '<' + REPLAY_RUN.format[1:] * (len(runs) // 2), *runs))
+            replay_file.write(b''.join(self.keyframes))
+
+    @classmethod
+    def load(cls, path):
+        """Read a replay file.
+
+        Args:
+            path: Path to the replay file.
+
+        Returns:
+            A Replay object.
+
+        Raises:
+            ValueError: The file is not a whole replay of this version.
+        """
+        with open(path, 'rb') as replay_file:
+            data = replay_file.read()
+        if len(data) < REPLAY_HEADER.size:
+            raise ValueError(f'{path} is too short for a replay file')
+        magic, version, seed, first, keyframes, runs, score, crashes = (
+            REPLAY_HEADER.unpack_from(data))
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f'{path} is not a version {REPLAY_VERSION} '
+                             'replay file')
+        replay = cls(seed, first)
+        replay.score, replay.crashes = score, crashes
+        offset = REPLAY_HEADER.size
+        end = offset + keyframes * REPLAY_INDEX.size + runs * REPLAY_RUN.size
+        if len(data) < end:
+            raise ValueError(f'{path} is too short for its keyframe index '
+                             'and inputs')
+        for tick, start, size in REPLAY_INDEX.iter_unpack(
+                data[offset:offset + keyframes * REPLAY_INDEX.size]):
+            if start + size > len(data):
+                raise ValueError(f'{path} has a keyframe past its end')
+            replay.ticks.append(tick)
+            replay.keyframes.append(data[start:start + size])
+        offset += keyframes * REPLAY_INDEX.size
+        replay.inputs = bytearray(b''.join(
+            bytes((bits,)) * count for bits, count in REPLAY_RUN.iter_unpack(
+                data[offset:offset + runs * REPLAY_RUN.size])))
+        return replay
+
+
+def verify_start(course_path=None):
+    """Set up a process to run verify_replay() in.
+
+    The game only needs images for their collision masks, so the display
+    is opened on SDL's dummy driver, with no window.
+
+    Args:
+        course_path: Course file the replays were played on, or None.
+    """
+    global IMAGES, EFFECTS, COURSE
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_mode((1, 1))
+    IMAGES = ImageStore(IMAGE_PATH, cache=IMAGE_CACHE)
+    EFFECTS = EffectsCache()
+    COURSE = CourseReader(course_path) if course_path else None
+
+
+def verify_replay(path):
+    """Play a replay again from its seed and check the result it claims.
+
+    The keyframes in the file are ignored, since they could have been
+    edited as easily as the claim; only the seed and the inputs are
+    trusted, and the game is simulated from its first tick with this
+    file's rules and no drawing.
+
+    Args:
+        path: Path to the replay file.
+
+    Returns:
+        A (path, ok, message) tuple.
+    """
+    try:
+        replay = Replay.load(path)
+    except (OSError, ValueError, struct.error) as error:
+        return path, False, str(error)
+    if replay.first != 0:
+        return path, False, f'starts at tick {replay.first}, not 0'
+    game = Game(replay.seed, course=COURSE)
+    for bits in replay.inputs:
+        if game.over:
+            return path, False, (f'has inputs after tick {game.tick}, '
+                                 'when the game ended')
+        game.step(bits)
+    score, crashes = game.player.score, game.player.crashes
+    if (score, crashes) != (replay.score, replay.crashes):
+        return path, False, (f'claims score {replay.score} and '
+                             f'{replay.crashes} crashes, but got score '
+                             f'{score} and {crashes} crashes')
+    return path, True, f'score {score}, {crashes} crashes'
+
+
+def verify(paths, course_path=None, workers=None):
+    """Check replays in parallel, one process per CPU.
+
+    Args:
+        paths: Paths to replay files.
+        course_path: Course file the replays were played on, or None.
+        workers: Number of processes, or None for one per CPU.
+
+    Returns:
+        How many replays failed.
+    """
+    from concurrent import futures
+
+    failed = 0
+    with futures.ProcessPoolExecutor(workers, initializer=verify_start,
+                                     initargs=(course_path,)) as pool:
+        for path, ok, message in pool.map(verify_replay, paths):
+            print(f'{path}: {"ok" if ok else "FAILED"}, {message}')
+            failed += not ok
+    return failed
+
+
+def benchmark(counts=BENCHMARK_COUNTS, frames=BENCHMARK_FRAMES):
+    """Compare drawing with the Surface and the Texture backends.
+
+    Args:
+        counts: Numbers of obstacles to draw.
+        frames: How many frames to draw for each test.
+    """
+    displays = (('surface', Display()), ('texture', TextureDisplay()))
+    for image_file in IMAGE_FILES:
+        IMAGES.get(image_file)
+    camera = Camera()
+    player = Player('kiiro')
+    player.rect.center = BOARD_WIDTH // 2, BOARD_HEIGHT // 2
+    for count in counts:
+        obstacles = ObstacleField()
+        for _ in range(count):
+            obstacle = make_obstacle()
+            obstacle.rect.y = random.randint(0, BOARD_HEIGHT)
+            obstacles.add(obstacle)
+        obstacles.follow(camera)
+        for name, display in displays:
+            start = time.perf_counter()
+            for _ in range(frames):
+                display.board.fill(BOARD_COLOR)
+                obstacles.draw(display.board, camera)
+                player.draw(display.board, camera)
+                show_stats(display.board, player.score, player.crashes)
+                display.present()
+            seconds = (time.perf_counter() - start) / frames
+            print(f'{count:5} obstacles  {name:8} {seconds * 1000:7.2f} ms')
+
+
+def main():
+    """Does the work.
+    """
+    for image_file in IMAGE_FILES:
+        IMAGES.get(image_file)
+    STARTUP.mark('images')
+    if IMAGE_REPORT:
+        print(IMAGES.report())
+
+    for sound_file in SOUND_FILES:
+        SOUNDS.add(sound_file)
+    SOUNDS.bg_start(BG_MUSIC)
+    STARTUP.mark('sounds')
+
+    controls = Controls()
+    if REPLAY:
+        game = Game(REPLAY.seed, course=COURSE)
+        REPLAY.seek(game, REPLAY.first + SEEK)
+        speed = REPLAY_SPEEDS.index(SPEED)
+        steps_due = 0.0  # Ticks to simulate, for speeds below 1
+    else:
+        game = Game(course=COURSE)
+        if LOAD_FILE:
+            with open(LOAD_FILE, 'rb') as load_file:
+                game.restore(load_file.read())
+    retry = game.snapshot()
+    recording = Replay(game.seed, game.tick) if RECORD_FILE else None
+    background = Background()
+    background.reset(game.camera)
+    render_queue = RenderQueue()
+    fading = []  # [obstacle, frames left] for picked up flags
+    chunks = ChunkRenderer() if CHUNKS else None
+    try:
+        particles = ParticleSystem()
+    except ImportError:
+        particles = None
+    STARTUP.mark('game')
+    if STARTUP_REPORT:
+        print(STARTUP.report())
+
+    if TELEMETRY:
+        TELEMETRY.log('start', seed=game.seed, tick=game.tick,
+                      course=COURSE is not None)
+    PACER.reset()
+    game_on = True
+    quitting = False  # Quit while paused; draw one more frame first
+    while game_on:
+        frame_start = time.perf_counter()
+        bits = controls.poll()
+        if bits & INPUT_QUIT or quitting:
+            game_on = False
+        paused = bits & INPUT_PAUSE and game_on and not game.over
+        jumped = False
+        if paused or not game_on:
+            events = []
+        elif REPLAY:
+            if bits & INPUT_RETRY:
+                REPLAY.seek(game, REPLAY.first)
+                jumped = True
+            if bits & INPUT_SEEK_BACK:
+                REPLAY.seek(game, game.tick - REPLAY_SEEK)
+                jumped = True
+            if bits & INPUT_SEEK_FORWARD:
+                REPLAY.seek(game, game.tick + REPLAY_SEEK)
+                jumped = True
+            if bits & INPUT_SPEED_UP:
+                speed = min(speed + 1, len(REPLAY_SPEEDS) - 1)
+            if bits & INPUT_SPEED_DOWN:
+                speed = max(speed - 1, 0)
+            events = []
+            steps_due += REPLAY_SPEEDS[speed]
+            while steps_due >= 1 and game.tick < REPLAY.last:
+                events += game.step(REPLAY.bits(game.tick))
+                steps_due -= 1
+            steps_due = min(steps_due, 1)
+        else:
+            if bits & INPUT_RETRY:
+                game.restore(retry)
+                if recording:
+                    recording = Replay(game.seed, game.tick)
+                if TELEMETRY:
+                    TELEMETRY.log('retry', tick=game.tick)
+                jumped = True
+            if recording:
+                recording.record(game, bits)
+            events = game.step(bits)
+        if jumped:
+            background.reset(game.camera)
+            fading = []
+            if chunks:
+                chunks = ChunkRenderer()
+
+        player, camera, obstacles = game.player, game.camera, game.obstacles
+        for event, obstacle in events:
+            if METRICS:
+                METRICS.events[event] += 1
+            if TELEMETRY and event in ('flag', 'ramp', 'crash'):
+                TELEMETRY.log(event, tick=game.tick, kind=obstacle.kind,
+                              x=obstacle.rect.x, y=obstacle.rect.y)
+            if event == 'flag':
+                SOUNDS.play('bonus')
+                if chunks:
+                    chunks.changed(obstacle)
+                fading.append([obstacle, FADE_TIME])
+            elif event == 'ramp':
+                SOUNDS.play('jump')
+            elif event == 'crash':
+                SOUNDS.play('crash')
+                if chunks:
+                    chunks.changed(obstacle)
+                if particles:
+                    particles.emit(DEBRIS, obstacle.rect.center)
+            elif event == 'turn':
+                if particles:
+                    particles.emit(SPRAY, player.rect.midbottom,
+                                   (-player.x_inc / 2, 0))
+            elif event == 'land':
+                if particles:
+                    particles.emit(DUST, player.rect.midbottom)
+
+        background.scroll(camera)
+        if player.crash_time > 0 or player.jump_time > 0:
+            background.track(None)
+        else:
+            background.track(player.rect.midbottom)
+        if particles:
+            particles.update()
+        for fade in fading:
+            fade[1] -= 1
+        fading = [fade for fade in fading if fade[1] >= 0]
+
+        if game.over and not REPLAY:
+            game_on = False
+        # The last frame is left for end_game() to draw on and present,
+        # since a texture renderer's back buffer is undefined after present
+        render = paused or not game_on or PACER.render_due()
+        if render:
+            background.draw(BOARD, camera)
+            if chunks:
+                chunks.draw(BOARD, camera, obstacles)
+                player_area = player.rect.union(
+                    player.rect.move(0, -player.jump_time))
+                obstacles.queue_in_front(render_queue, camera, player,
+                                         player_area)
+            else:
+                obstacles.queue(render_queue, camera)
+            player.queue(render_queue, camera)
+            for flag, frames_left in fading:
+                image = EFFECTS.get(flag.name, 'fade',
+                                    EFFECTS.level(1 - frames_left / FADE_TIME))
+                render_queue.add(image, camera.to_board(flag.rect),
+                                 flag.rect.bottom)
+            render_queue.draw(BOARD)
+            if particles:
+                particles.draw(BOARD, camera)
+            show_stats(BOARD, player.score, player.crashes)
+            if REPLAY:
+                BOARD.blit(text2image(f'Replay {REPLAY_SPEEDS[speed]:g}x'),
+                           (0, 0))
+
+        if paused:
+            pause_start = time.perf_counter()
+            quitting = not pause_game(controls)
+            if TELEMETRY:
+                TELEMETRY.log('pause', tick=game.tick, seconds=round(
+                    time.perf_counter() - pause_start, 3))
+            PACER.reset()  # So the pause does not count as a slow frame
+            continue
+        if render and game_on:
+            DISPLAY.present()
+            PACER.presented()
+            if METRICS:
+                METRICS.presented()
+        work_time = time.perf_counter() - frame_start
+        frame_ms = PACER.wait()
+        if TELEMETRY:
+            TELEMETRY.log('frame', tick=game.tick,
+                          work_ms=round(work_time * 1000, 3),
+                          frame_ms=frame_ms)
+        if METRICS:
+            METRICS.tick(work_time, frame_ms / 1000)
+            METRICS.state = (game.tick, player.score, player.crashes,
+                             len(obstacles.active), len(obstacles.dormant),
+                             len(particles) if particles else 0)
+    if PACING_REPORT:
+        print(PACER.report())
+    if TELEMETRY:
+        TELEMETRY.log('end', tick=game.tick, score=game.player.score,
+                      crashes=game.player.crashes, over=game.over)
+    if recording:
+        recording.score = game.player.score
+        recording.crashes = game.player.crashes
+        recording.save(RECORD_FILE)
+    if REPLAY:
+        return
+    if SAVE_FILE and not game.over:
+        with open(SAVE_FILE, 'wb') as save_file:
+            save_file.write(game.snapshot())
+    if LEADERBOARD and game.over:
+        LEADERBOARD.add(PLAYER_NAME, game.player.score, game.player.crashes,
+                        game.seed)
     end_game()
 
 
 if __name__ == '__main__':
-    pygame.init()
-    BOARD = pygame.display.set_mode(BOARD_SIZE)
+    STARTUP = StartupTimer()
+    parser = argparse.ArgumentParser(description='A simple skiing game.')
+    parser.add_argument('--course', help='course file to ski')
+    parser.add_argument('--compile-course', nargs=2,
+                        metavar=('TEXT', 'COURSE'),
+                        help='turn a text course into a course file')
+    parser.add_argument('--image-report', action='store_true',
+                        help='show how each image is drawn, and how fast')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='window pixels for each board pixel')
+    parser.add_argument('--integer-scale', action='store_true',
+                        help='round the scale down to a whole number')
+    parser.add_argument('--scaled', action='store_true',
+                        help='let SDL scale the board to the window')
+    parser.add_argument('--fullscreen', action='store_true',
+                        help='scale the board to fill the screen')
+    parser.add_argument('--renderer', choices=('surface', 'texture'),
+                        default='surface',
+                        help='draw with Surface blits or SDL2 textures')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='time both renderers and quit')
+    parser.add_argument('--chunks', action='store_true',
+                        help='draw obstacles from pre-composited chunks')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the game to a file when quitting')
+    parser.add_argument('--load', metavar='FILE',
+                        help='carry on a game saved with --save')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the game to a replay file')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='play back a replay file; the arrow keys seek '
+                        'and change speed')
+    parser.add_argument('--speed', type=float, default=1,
+                        choices=REPLAY_SPEEDS,
+                        help='replay speed to start at')
+    parser.add_argument('--seek', type=int, default=0, metavar='TICKS',
+                        help='how far into the replay to start')
+    parser.add_argument('--verify', nargs='+', metavar='FILE',
+                        help='check the scores claimed by replay files and '
+                        'quit')
+    parser.add_argument('--workers', type=int,
+                        help='processes to use for --verify')
+    parser.add_argument('--player', default='anonymous', metavar='NAME',
+                        help='name to put on the leaderboard')
+    parser.add_argument('--leaderboard', default=LEADERBOARD_FILE,
+                        metavar='FILE', help='leaderboard database file')
+    parser.add_argument('--telemetry', metavar='FOLDER',
+                        help='log game events and frame times to '
+                        'compressed files in a folder (not for --replay)')
+    parser.add_argument('--metrics', type=int, metavar='PORT',
+                        help='serve Prometheus metrics on localhost')
+    parser.add_argument('--pacing', choices=PACER_MODES, default='tick',
+                        help='how to wait for each frame: sleep, spin, or '
+                        'sleep then spin')
+    parser.add_argument('--pacing-report', action='store_true',
+                        help='show how steady frames were when quitting')
+    parser.add_argument('--no-sound', action='store_true',
+                        help='play without sound, and skip starting the mixer')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='show how long each step of starting took')
+    args = parser.parse_args()
+    if args.compile_course:
+        compile_course(*args.compile_course)
+        raise SystemExit
+    if args.verify:
+        raise SystemExit(1 if verify(args.verify, args.course,
+                                     args.workers) else 0)
+    COURSE = CourseReader(args.course) if args.course else None
+    IMAGE_REPORT = args.image_report
+    STARTUP_REPORT = args.startup_report
+    CHUNKS = args.chunks
+    SAVE_FILE = args.save
+    LOAD_FILE = args.load
+    RECORD_FILE = args.record
+    REPLAY = Replay.load(args.replay) if args.replay else None
+    SPEED = args.speed
+    SEEK = args.seek
+    METRICS = Metrics(args.metrics) if args.metrics else None
+    if args.telemetry and not args.replay:
+        TELEMETRY = Telemetry(args.telemetry)
+    else:
+        TELEMETRY = None
+    STARTUP.mark('arguments')
+    pygame.display.init()
+    if args.benchmark:
+        pygame.font.init()
+        IMAGES = ImageStore(IMAGE_PATH, cache=IMAGE_CACHE)
+        EFFECTS = EffectsCache()
+        benchmark()
+        raise SystemExit
+    if args.renderer == 'texture':
+        DISPLAY = TextureDisplay(args.scale, args.integer_scale,
+                                 args.fullscreen)
+    else:
+        DISPLAY = Display(args.scale, args.integer_scale, args.scaled,
+                          args.fullscreen)
+    BOARD = DISPLAY.board
+    STARTUP.mark('display')
+    pygame.font.init()
+    STARTUP.mark('font')
+    if not args.no_sound:
+        try:
+            pygame.mixer.init()
+        except pygame.error as error:
+            print(f'NOTICE: Could not start sound ({error}), playing '
+                  'without it.')
+        STARTUP.mark('mixer')
     CLOCK = pygame.time.Clock()
-    IMAGES = ImageStore(IMAGE_PATH)
+    PACER = FramePacer(CLOCK, mode=args.pacing)
+    PACING_REPORT = args.pacing_report
+    IMAGES = ImageStore(IMAGE_PATH, cache=IMAGE_CACHE)
+    EFFECTS = EffectsCache()
     SOUNDS = SoundStore(SOUND_PATH)
+    PLAYER_NAME = args.player
+    try:
+        import sqlite3
+        LEADERBOARD = Leaderboard(args.leaderboard)
+    except ImportError:
+        LEADERBOARD = None
+    except sqlite3.Error as error:
+        print(f'NOTICE: Could not open leaderboard {args.leaderboard} '
+              f'({error}), playing without it.')
+        LEADERBOARD = None
     main()
+    if LEADERBOARD:
+        LEADERBOARD.close()
+    if TELEMETRY:
+        TELEMETRY.close()
+    if METRICS:
+        METRICS.close()
     pygame.quit()
+    if COURSE:
+        COURSE.close()